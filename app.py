@@ -1,42 +1,100 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context, g, has_request_context
 import json
+import csv
+import io
 import psycopg2
-from psycopg2.extras import DictCursor
+from psycopg2.extras import DictCursor, execute_values
 import hashlib
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Mapping, Optional
 import os
 from dotenv import load_dotenv
 import logging
 import nacos
 import yaml
+from db_pool import DBPool
+from nacos_cache import NacosConfigCache
+from singleflight import SingleFlight
+from circuit_breaker import BreakerRegistry, CircuitBreaker, CircuitOpenError
+from metrics import Registry, gauge_lines
+from log_config import setup_logging, restart_logging_after_fork
+from ttl_cache import TTLCache
+from env_store import EnvStore, EnvStoreError
+from replica_router import ReplicaRouter
+import prepared
+import time
+import threading
+from contextlib import contextmanager
+from functools import partial
+import queue
+from collections import deque
+import queries
 
 app = Flask(__name__)
 
-# 配置日志
-logging.basicConfig(level=logging.INFO)
+# 日志在加载配置后由 setup_logging 初始化(异步写出、JSON格式、敏感字段脱敏)
 logger = logging.getLogger(__name__)
 
 # 加载环境变量
 load_dotenv()
 
 # Nacos配置缓存 - {server_address}_{namespace}: config
-nacos_config_cache = {}
+nacos_config_cache = NacosConfigCache()
 # 当前活跃的Nacos客户端
 active_nacos_clients = {}
+# 数据库连接池 - {server_address}_{namespace}: (db_config, DBPool)
+db_pools = {}
+# 余额读缓存 - {server_address}_{namespace}: TTLCache(phone: (balance, encrypt)), 见 balance_cache 配置
+balance_caches = {}
+# 手机号到会员ID的映射 - {server_address}_{namespace}: TTLCache(phone: member_id), 见 member_cache 配置
+member_caches = {}
+# 合并同一环境并发的客户端初始化、配置拉取和连接池创建
+inflight_calls = SingleFlight()
+# 各环境Nacos/数据库熔断器 - nacos:{client_key} / db:{client_key}
+circuit_breakers = BreakerRegistry()
+# 从库读路由状态(轮询位置、复制延迟、刚写入的手机号), 见 read_replicas 配置
+replica_router = ReplicaRouter()
+# 前端保存的Nacos环境列表
+env_store = EnvStore(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'nacos-data', 'nacos_configs.json'))
+
+# 指标, 由 /metrics 输出
+metrics_registry = Registry()
+REQUEST_SECONDS = metrics_registry.histogram(
+    'balance_http_request_duration_seconds', '接口处理耗时', ('route', 'method', 'status'))
+ENV_RESOLVE_SECONDS = metrics_registry.histogram(
+    'balance_env_resolve_duration_seconds', '请求解析Nacos环境耗时', ('route',))
+NACOS_FETCH_SECONDS = metrics_registry.histogram(
+    'balance_nacos_fetch_duration_seconds', '从Nacos拉取common.yml耗时', ('env',))
+NACOS_CACHE_REQUESTS = metrics_registry.counter(
+    'balance_nacos_config_cache_requests_total', 'Nacos配置缓存命中/未命中次数', ('env', 'result'))
+DB_CONNECT_SECONDS = metrics_registry.histogram(
+    'balance_db_connect_duration_seconds', '新建数据库连接耗时', ('env',))
+DB_QUERY_SECONDS = metrics_registry.histogram(
+    'balance_db_query_duration_seconds', 'SQL执行耗时', ('env', 'query'))
+BALANCE_CACHE_REQUESTS = metrics_registry.counter(
+    'balance_balance_cache_requests_total', '余额读缓存命中/未命中次数', ('env', 'result'))
+DB_READ_ROUTES = metrics_registry.counter(
+    'balance_db_read_routes_total', '只读请求路由到从库/主库的次数', ('env', 'target', 'reason'))
 
 
 
 def init_nacos_client(server_addresses, namespace, username=None, password=None):
-    logger.info(f"get_nacos_config - server_addresses: {server_addresses}, namespace: {namespace}")
     client_key = f"{server_addresses}_{namespace}"
-    logger.info(f"生成的client_key: {client_key}")
-    try:
-        # 如果客户端已存在，直接使用
-        if client_key in active_nacos_clients:
-            logger.info(f"使用缓存的Nacos客户端: {client_key}")
-            return True
+    # 如果客户端已存在，直接使用(无锁读取)
+    if client_key in active_nacos_clients:
+        logger.debug("使用缓存的Nacos客户端: %s", client_key)
+        return True
+    # 同一环境的并发初始化只创建一个客户端, 其余请求共享结果
+    return inflight_calls.do(('nacos_client', client_key), _create_nacos_client,
+                             client_key, server_addresses, namespace, username, password)
 
+def _create_nacos_client(client_key, server_addresses, namespace, username, password):
+    if client_key in active_nacos_clients:
+        return True
+    try:
         # 创建新客户端
-        logger.info(f"创建Nacos客户端 - 参数: server_addresses={server_addresses}, namespace={namespace}, username={username}, password={'******' if password else None}")
+        logger.info("创建Nacos客户端 - 参数: server_addresses=%s, namespace=%s, username=%s, password=%s", server_addresses, namespace, username, ('******' if password else None))
         client = nacos.NacosClient(
             server_addresses=server_addresses,
             namespace=namespace,
@@ -44,146 +102,150 @@ def init_nacos_client(server_addresses, namespace, username=None, password=None)
             password=password or None
         )
         active_nacos_clients[client_key] = client
-        logger.info(f"Nacos客户端初始化成功: {client_key}")
+        logger.info("Nacos客户端初始化成功: %s", client_key)
         return True
     except Exception as e:
-        logger.error(f"Nacos客户端初始化失败: {str(e)}", exc_info=True)
-        logger.exception("Nacos客户端初始化异常堆栈:")
+        logger.error("Nacos客户端初始化失败: %s", e, exc_info=True)
         return False
 
-def get_nacos_config(server_addresses, namespace, group='v1.0.0'):
-    """从Nacos获取配置"""
-    client_key = f"{server_addresses}_{namespace}"
-    if client_key not in active_nacos_clients:
-        logger.error(f"Nacos客户端未初始化: {client_key}")
-        return None
+def parse_nacos_config(content):
+    """解析common.yml内容, 提取PostgreSQL配置和网关地址"""
+    nacos_config = yaml.safe_load(content)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("解析后的配置: %s", nacos_config)
+    # 检查网关配置
+    if 'gateway' not in nacos_config:
+        logger.error("配置中未找到gateway节点")
+    elif 'url' not in nacos_config['gateway']:
+        logger.error("gateway节点中未找到url字段")
     
-    # 检查缓存
-    if client_key in nacos_config_cache:
-        logger.info(f"使用缓存的Nacos配置: {client_key}")
-        return nacos_config_cache[client_key]
+    # 提取PostgreSQL配置和网关地址
+    result = {}
+    if 'pgsql' in nacos_config:
+        pg_config = nacos_config['pgsql']
+        db_config = {
+            'host': pg_config.get('address', 'localhost'),
+            'port': int(pg_config.get('port', 5432)),
+            'user': pg_config.get('username', 'postgres'),
+            'password': pg_config.get('password', ''),
+            'dbname': pg_config.get('dbname', 'postgres')
+        }
+        result['db_config'] = db_config
+        # 可选的只读从库, 省略的字段沿用主库配置
+        replicas = []
+        for replica in pg_config.get('replicas') or []:
+            if isinstance(replica, str):
+                replica = {'address': replica}
+            replicas.append({
+                'host': replica.get('address', db_config['host']),
+                'port': int(replica.get('port', db_config['port'])),
+                'user': replica.get('username', db_config['user']),
+                'password': replica.get('password', db_config['password']),
+                'dbname': replica.get('dbname', db_config['dbname'])
+            })
+        if replicas:
+            result['replica_configs'] = replicas
     
-    try:
-        client = active_nacos_clients[client_key]
-        # 从配置文件获取默认值
-        config_file = 'common.yml'
-        config_group = group
-        logger.info(f"尝试从Nacos获取配置 - 服务器: {server_addresses}, 命名空间: {namespace}, 配置文件: {config_file}, 配置组: {config_group}")
-        
-        # 获取配置内容
-        logger.info(f"尝试获取Nacos配置: {config_file} (group: {config_group})")
-        content = client.get_config(config_file, config_group)
-        logger.info(f"获取到的配置内容: {content}")
-        if not content:
-            logger.error("从Nacos获取的配置内容为空")
-        
-        if not content:
-            logger.error("未找到配置内容")
-            return None
-        
-        # 解析YAML内容
-        nacos_config = yaml.safe_load(content)
-        logger.info(f"解析后的配置: {nacos_config}")
-        # 检查网关配置
-        if 'gateway' not in nacos_config:
-            logger.error("配置中未找到gateway节点")
-        elif 'url' not in nacos_config['gateway']:
-            logger.error("gateway节点中未找到url字段")
-        
-        # 提取PostgreSQL配置和网关地址
-        result = {}
-        if 'pgsql' in nacos_config:
-            pg_config = nacos_config['pgsql']
-            result['db_config'] = {
-                'host': pg_config.get('address', 'localhost'),
-                'port': int(pg_config.get('port', 5432)),
-                'user': pg_config.get('username', 'postgres'),
-                'password': pg_config.get('password', ''),
-                'dbname': pg_config.get('dbname', 'postgres')
-            }
-        
-        if 'gateway' in nacos_config and 'url' in nacos_config['gateway']:
-            result['gateway_url'] = nacos_config['gateway']['url']
-            
-        # 缓存配置
-        nacos_config_cache[client_key] = result
-        return result
-    except Exception as e:
-        logger.error(f"获取Nacos配置失败: {str(e)}")
-        logger.exception(e)  # 打印详细的错误堆栈
-        return None
+    if 'gateway' in nacos_config and 'url' in nacos_config['gateway']:
+        result['gateway_url'] = nacos_config['gateway']['url']
+    # 配置版本(内容MD5, 与Nacos一致), 用于生成ETag
+    result['version'] = hashlib.md5(content.encode('utf-8')).hexdigest()
+    return result
 
-# 移除重复的路由定义
+class NacosConfigEmptyError(Exception):
+    """Nacos中的配置不存在或内容为空"""
 
+def fetch_nacos_config(client, server_addresses, namespace, group='v1.0.0'):
+    """从Nacos拉取并解析配置, 返回 (解析结果, 原始内容)
 
+    不使用SDK的本地快照: 连接失败时抛出异常, 配置为空时抛出 NacosConfigEmptyError, 均计入熔断器失败
+    """
+    config_file = 'common.yml'
+    logger.info("尝试从Nacos获取配置 - 服务器: %s, 命名空间: %s, 配置文件: %s, 配置组: %s", server_addresses, namespace, config_file, group)
+    with NACOS_FETCH_SECONDS.time(env=f"{server_addresses}_{namespace}"):
+        content = client.get_config(config_file, group, no_snapshot=True)
+    logger.debug("获取到的配置内容长度: %s", len(content) if content else 0)
+    if not content:
+        raise NacosConfigEmptyError(f"Nacos中{config_file}(group: {group})不存在或内容为空")
+    return parse_nacos_config(content), content
+
+def watch_nacos_config(client, client_key, content, group='v1.0.0'):
+    """订阅common.yml变更, 变更时直接替换缓存, 返回注销监听的函数
+
+    content 为刚拉取到的内容, 作为监听的初始值, SDK不会再同步拉取一次
+    """
+    config_file = 'common.yml'
+
+    def on_change(params):
+        content = params.get('content')
+        if not content:
+            logger.warning("Nacos配置被删除或为空, 继续使用缓存: %s", client_key)
+            return
+        try:
+            nacos_config_cache.update(client_key, parse_nacos_config(content))
+            logger.info("Nacos配置已变更, 缓存已刷新: %s", client_key)
+        except Exception as e:
+            logger.error("解析变更后的Nacos配置失败: %s, %s", client_key, e)
 
-@app.route('/get_gateway_url')
-def get_gateway_url():
     try:
-        server_address = request.args.get('server_address')
-        namespace = request.args.get('namespace')
-        username = request.args.get('username', 'nacos')  # 允许URL参数覆盖默认用户名
-        password = request.args.get('password', 'nacos')  # 允许URL参数覆盖默认密码
-    
-        if not server_address or not namespace:
-            return jsonify({'success': False, 'message': '缺少必要参数: server_address和namespace'}), 400
-    
-        # 处理服务器地址格式
-        if ':' not in server_address:
-            server_address_with_port = f'{server_address}:8848'
-        else:
-            server_address_with_port = server_address
-        client_key = f'{server_address_with_port}_{namespace}'
-        logger.info(f'get_gateway_url调用 - 参数: server={server_address_with_port}, namespace={namespace}, client_key={client_key}')
-    
-        # 检查并初始化Nacos客户端
-        if client_key not in active_nacos_clients:
-            logger.info(f'客户端{client_key}不存在，尝试初始化...')
-            init_success = init_nacos_client(
-                server_addresses=server_address_with_port,
-                namespace=namespace,
-                username=username,
-                password=password
-            )
-            if not init_success:
-                return jsonify({
-                    'success': False,
-                    'message': f'Nacos客户端初始化失败: {client_key}',
-                    'details': '请检查Nacos服务器地址、命名空间及凭据是否正确'
-                }), 500
+        client.add_config_watcher(config_file, group, on_change, content=content)
+    except Exception as e:
+        logger.warning("订阅Nacos配置变更失败, 仅依赖TTL刷新: %s, %s", client_key, e)
+        return None
+    return lambda: client.remove_config_watcher(config_file, group, on_change)
+
+def get_nacos_config(server_addresses, namespace, group='v1.0.0'):
+    """从Nacos获取配置, 配置不存在时返回None; Nacos不可达或熔断打开时抛出异常"""
+    client_key = f"{server_addresses}_{namespace}"
+    if client_key not in active_nacos_clients:
+        logger.error("Nacos客户端未初始化: %s", client_key)
+        return None
     
-        # 获取配置
-        nacos_config = get_nacos_config(server_address_with_port, namespace)
-        if not nacos_config:
-            return jsonify({
-                'success': False,
-                'message': '未找到Nacos配置',
-                'details': f'配置路径: common.yml, 命名空间: {namespace}'
-            }), 404
+    # 检查缓存(过期时后台刷新, 期间继续返回旧配置)
+    cached = nacos_config_cache.get(client_key)
+    NACOS_CACHE_REQUESTS.inc(env=client_key, result='miss' if cached is None else 'hit')
+    if cached is not None:
+        logger.debug("使用缓存的Nacos配置: %s", client_key)
+        return cached
     
-        # 验证网关URL
-        if 'gateway_url' not in nacos_config:
-            return jsonify({
-                'success': False,
-                'message': '配置中缺少网关URL',
-                'details': f'当前配置: {json.dumps(nacos_config, ensure_ascii=False)}'
-            }), 404
+    # 同一环境并发的缓存未命中只向Nacos发起一次拉取
+    return inflight_calls.do(('nacos_config', client_key), _load_nacos_config,
+                             client_key, server_addresses, namespace, group)
 
-        return jsonify({
-            'success': True,
-            'gateway_url': nacos_config['gateway_url'],
-            'message': '网关配置获取成功',
-            'server_info': f'{server_address_with_port} (namespace: {namespace})'
-        })
-    except Exception as e:
-        logger.error(f"获取网关URL失败: {str(e)}", exc_info=True)
-        return jsonify({
-            'success': False,
-            'message': f'服务器内部错误: {str(e)}'
-        }), 500
+def _load_nacos_config(client_key, server_addresses, namespace, group):
+    cached = nacos_config_cache.peek(client_key)
+    if cached is not None:
+        return cached
 
+    breaker = circuit_breakers.get(f'nacos:{client_key}')
+    try:
+        client = active_nacos_clients[client_key]
+        result, content = breaker.call(fetch_nacos_config, client, server_addresses, namespace, group)
 
+        # 缓存配置并订阅变更, 后台刷新同样经过熔断器
+        nacos_config_cache.set(
+            client_key,
+            result,
+            loader=lambda: breaker.call(fetch_nacos_config, client, server_addresses, namespace, group)[0],
+            on_evict=watch_nacos_config(client, client_key, content, group)
+        )
+        return result
+    except CircuitOpenError as e:
+        logger.warning("Nacos环境不可用, 快速失败: %s", e)
+        raise
+    except NacosConfigEmptyError as e:
+        logger.error("未找到配置内容: %s", e)
+        return None
+    except Exception as e:
+        logger.error("获取Nacos配置失败: %s", e)
+        logger.exception(e)  # 打印详细的错误堆栈
+        raise
 
+def _connection_factory():
+    """启用预处理语句时使用记录已PREPARE语句的连接类"""
+    if (config.get('prepared_statements') or {}).get('enabled', True):
+        return prepared.PreparingConnection
+    return psycopg2.extensions.connection
 
 def get_db_connection_with_config(config):
     """根据提供的配置获取数据库连接"""
@@ -192,14 +254,15 @@ def get_db_connection_with_config(config):
         if not db_config:
             raise Exception("配置中缺少数据库配置")
         
-        logger.info(f"尝试连接数据库: {db_config['host']}:{db_config['port']}/{db_config['dbname']}")
+        logger.info("尝试连接数据库: %s:%s/%s", db_config['host'], db_config['port'], db_config['dbname'])
         return psycopg2.connect(
+            connection_factory=_connection_factory(),
             cursor_factory=DictCursor,
             connect_timeout=3,
             **db_config
         )
     except psycopg2.OperationalError as e:
-        logger.error(f"数据库连接失败: {str(e)}")
+        logger.error("数据库连接失败: %s", e)
         error_message = str(e)
         if "No such file or directory" in error_message:
             raise Exception(
@@ -216,6 +279,390 @@ def get_db_connection_with_config(config):
         else:
             raise Exception(f"连接数据库时出错: {error_message}")
 
+def get_db_pool(client_key, nacos_config):
+    """获取环境对应的数据库连接池, 数据库配置变化时重建"""
+    db_config = nacos_config.get('db_config')
+    if not db_config:
+        raise Exception("配置中缺少数据库配置")
+
+    return _get_pool(client_key, db_config)
+
+def _get_pool(pool_key, db_config):
+    entry = db_pools.get(pool_key)
+    if entry and entry[0] == db_config:
+        return entry[1]
+    return inflight_calls.do(('db_pool', pool_key), _create_db_pool, pool_key, db_config)
+
+def replica_targets(client_key, nacos_config):
+    """环境的从库列表 [(连接池key, db_config)]"""
+    return [
+        (f"{client_key}/replica/{db_config['host']}:{db_config['port']}", db_config)
+        for db_config in nacos_config.get('replica_configs') or []
+    ]
+
+def _timed_db_connect(client_key, db_config):
+    with DB_CONNECT_SECONDS.time(env=client_key):
+        return get_db_connection_with_config({'db_config': db_config})
+
+def _create_db_pool(client_key, db_config):
+    entry = db_pools.get(client_key)
+    if entry and entry[0] == db_config:
+        return entry[1]
+
+    pool_config = dict(config.get('db_pool') or {})
+    logger.info("创建数据库连接池: %s, 参数: %s", client_key, pool_config)
+    snapshot = dict(db_config)
+    breaker = circuit_breakers.get(f'db:{client_key}')
+    pool = DBPool(
+        client_key,
+        lambda: breaker.call(_timed_db_connect, client_key, snapshot),
+        **pool_config
+    )
+    db_pools[client_key] = (snapshot, pool)
+
+    if entry:
+        logger.info("数据库配置已变化, 关闭旧连接池: %s", client_key)
+        balance_caches.pop(client_key, None)
+        member_caches.pop(client_key, None)
+        entry[1].close()
+    return pool
+
+@app.before_request
+def start_request_timer():
+    # 先于环境解析注册, 计时覆盖完整请求
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def observe_request_duration(response):
+    started = g.get('request_started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        REQUEST_SECONDS.observe(time.perf_counter() - started, route=route,
+                                method=request.method, status=response.status_code)
+    return response
+
+@app.after_request
+def set_written_lsn_cookie(response):
+    """写入请求把主库WAL位置带回客户端, 后续读请求无论落在哪个worker都能避开未回放的从库"""
+    written = g.get('written_lsn')
+    if written is not None:
+        cookie = replica_router.written_lsn_cookie_args(*written)
+        if cookie:
+            response.set_cookie(**cookie)
+    return response
+
+def record_write(env, conn, phones):
+    """写入已提交: 本进程内这些手机号短时间读主库, 并在 conn 上读取主库WAL位置写入响应cookie"""
+    for phone in phones:
+        replica_router.pin(env.client_key, phone)
+    if not phones or not env.config.get('replica_configs') or not has_request_context():
+        return
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(queries.CURRENT_WAL_LSN)
+            g.written_lsn = (env.client_key, cursor.fetchone()[0])
+    except psycopg2.Error as e:
+        logger.warning("读取主库WAL位置失败: %s, %s", env.client_key, e)
+
+def limit_statement_time(cursor, seconds):
+    """当前事务内的SQL最多执行 seconds 秒, 用于有等待上限的并行查询, 超时的查询不会继续占用连接"""
+    cursor.execute(queries.SET_STATEMENT_TIMEOUT, (max(1, int(seconds * 1000)),))
+
+def timed_query(name, env=None):
+    """统计一条SQL的执行耗时, 默认使用当前请求的环境"""
+    return DB_QUERY_SECONDS.time(env=(env or g.env).client_key, query=name)
+
+def _acquire_replica(env, phone, min_lsn=None, timeout=None, phones=()):
+    """按路由借出一个延迟正常(且已回放到 min_lsn)的从库连接, 返回 (replica_key, pool, conn) 或 None(读主库)"""
+    replicas = dict(env.replicas)
+    reason = 'no_replica'
+    for _ in range(max(len(replicas), 1)):
+        replica_key, reason = replica_router.choose(env.client_key, list(replicas), phone, phones)
+        if replica_key is None:
+            break
+        try:
+            pool = _get_pool(replica_key, replicas[replica_key])
+            conn = pool.getconn(timeout)
+        except Exception as e:
+            logger.warning("从库不可用, 暂停使用: %s, %s", replica_key, e)
+            replica_router.mark_failed(replica_key, e)
+            reason = 'unavailable'
+            continue
+        if replica_router.needs_lag_check(replica_key):
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute(queries.REPLICATION_LAG)
+                    lag = cursor.fetchone()[0]
+            except Exception as e:
+                logger.warning("检查从库复制延迟失败: %s, %s", replica_key, e)
+                pool.putconn(conn, discard=True)
+                replica_router.mark_failed(replica_key, e)
+                reason = 'unavailable'
+                continue
+            if not replica_router.record_lag(replica_key, lag):
+                logger.warning("从库复制延迟过大, 暂停使用: %s, %s秒", replica_key, lag)
+                pool.putconn(conn)
+                reason = 'lagging'
+                continue
+        if min_lsn is not None:
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute(queries.REPLAYED_LSN, (min_lsn,))
+                    replayed = cursor.fetchone()[0]
+            except Exception as e:
+                logger.warning("检查从库回放位置失败: %s, %s", replica_key, e)
+                pool.putconn(conn, discard=True)
+                replica_router.mark_failed(replica_key, e)
+                reason = 'unavailable'
+                continue
+            if not replayed:
+                pool.putconn(conn)
+                reason = 'behind_write'
+                continue
+        DB_READ_ROUTES.inc(env=env.client_key, target='replica', reason='ok')
+        return replica_key, pool, conn
+    DB_READ_ROUTES.inc(env=env.client_key, target='primary', reason=reason)
+    return None
+
+@contextmanager
+def read_connection(env, phone=None, cookies=None, timeout=None, phones=()):
+    """只读请求使用的连接: 轮询从库, 没有可用从库或该手机号刚写入时使用主库
+
+    批量读取通过 phones 传入全部手机号;
+    cookies 默认取当前请求的cookie, 其中的写入位置用于跳过尚未回放到该位置的从库;
+    timeout 限制从连接池借连接的等待秒数
+    """
+    if not env.config.get('replica_configs'):
+        acquired = None
+    else:
+        if cookies is None:
+            cookies = request.cookies if has_request_context() else {}
+        acquired = _acquire_replica(env, phone, replica_router.written_lsn(env.client_key, cookies), timeout, phones)
+    if acquired is None:
+        with env.db.connection(timeout) as conn:
+            yield conn
+        return
+
+    replica_key, pool, conn = acquired
+    broken = False
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+        broken = True
+        replica_router.mark_failed(replica_key, e)
+        raise
+    finally:
+        pool.putconn(conn, discard=broken)
+
+class EnvResolveError(Exception):
+    """请求环境解析失败"""
+
+    def __init__(self, message, status=500, details=None):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.details = details
+
+
+@dataclass(frozen=True)
+class EnvContext:
+    """已解析的Nacos环境, 同一份配置在多个请求间复用"""
+    server_address: str
+    namespace: str
+    client_key: str
+    config: Mapping
+    gateway_url: Optional[str]
+
+    @property
+    def server_info(self):
+        return f'{self.server_address} (namespace: {self.namespace})'
+
+    @property
+    def db(self):
+        """环境对应的数据库连接池(主库), 首次使用时创建"""
+        return get_db_pool(self.client_key, self.config)
+
+    @property
+    def replicas(self):
+        return replica_targets(self.client_key, self.config)
+
+
+# 已解析的环境上下文 - client_key: (nacos_config, EnvContext), 配置刷新后重新生成
+env_contexts = {}
+
+def normalize_server_address(server_address, namespace):
+    """补全默认端口, 返回 (server_address, client_key)"""
+    server_address = server_address.strip()
+    if ':' not in server_address:
+        server_address = f'{server_address}:8848'
+    return server_address, f'{server_address}_{namespace}'
+
+def resolve_env(server_address, namespace, username='nacos', password='nacos', require_db=True):
+    """解析Nacos环境, 失败时抛出 EnvResolveError"""
+    if not server_address or not namespace:
+        raise EnvResolveError('缺少必要参数: server_address和namespace', 400)
+    server_address, client_key = normalize_server_address(server_address, namespace)
+
+    if not init_nacos_client(server_addresses=server_address, namespace=namespace,
+                             username=username, password=password):
+        raise EnvResolveError(f'Nacos客户端初始化失败: {client_key}', 500,
+                              '请检查Nacos服务器地址、命名空间及凭据是否正确')
+
+    try:
+        nacos_config = get_nacos_config(server_address, namespace)
+    except CircuitOpenError as e:
+        raise EnvResolveError(f'Nacos环境不可用: {e}', 503)
+    except Exception as e:
+        raise EnvResolveError(f'获取Nacos配置失败: {e}', 503, '请检查Nacos服务器是否可以访问')
+    if not nacos_config:
+        raise EnvResolveError('未找到Nacos配置', 404, f'配置路径: common.yml, 命名空间: {namespace}')
+    if require_db and 'db_config' not in nacos_config:
+        raise EnvResolveError('配置中缺少数据库配置', 404, '请检查common.yml是否包含正确的PostgreSQL配置')
+
+    entry = env_contexts.get(client_key)
+    if entry and entry[0] is nacos_config:
+        return entry[1]
+    ctx = EnvContext(
+        server_address=server_address,
+        namespace=namespace,
+        client_key=client_key,
+        config=MappingProxyType(nacos_config),
+        gateway_url=nacos_config.get('gateway_url'),
+    )
+    env_contexts[client_key] = (nacos_config, ctx)
+    return ctx
+
+def nacos_env(require_db=True, error_style='success'):
+    """标记路由需要Nacos环境, 由 before_request 统一解析后放入 g.env
+
+    error_style: 'success' 返回 {'success': False, ...}, 'status' 返回 {'status': 'error', ...}
+    """
+    def decorator(view):
+        view.nacos_env = {'require_db': require_db, 'error_style': error_style}
+        return view
+    return decorator
+
+@app.before_request
+def resolve_request_env():
+    view = app.view_functions.get(request.endpoint)
+    options = getattr(view, 'nacos_env', None)
+    if options is None:
+        return None
+    try:
+        with ENV_RESOLVE_SECONDS.time(route=request.url_rule.rule):
+            g.env = resolve_env(
+                request.args.get('server_address', ''),
+                request.args.get('namespace'),
+                username=request.args.get('username', 'nacos'),
+                password=request.args.get('password', 'nacos'),
+                require_db=options['require_db']
+            )
+        return None
+    except EnvResolveError as e:
+        message, status, details = e.message, e.status, e.details
+    except Exception as e:
+        logger.error("解析Nacos环境失败: %s", e, exc_info=True)
+        message, status, details = f'服务器内部错误: {str(e)}', 500, None
+
+    if options['error_style'] == 'status':
+        body = {'status': 'error', 'message': message, 'breakers': circuit_breakers.snapshot()}
+    else:
+        body = {'success': False, 'message': message}
+        if details:
+            body['details'] = details
+    return jsonify(body), status
+
+# fork前创建的连接池, worker中只保留引用, 避免回收时关闭与master共享的socket
+_inherited_pools = []
+
+def reset_after_fork():
+    """在fork出的worker中重置Nacos客户端、配置缓存和数据库连接池"""
+    global nacos_config_cache, inflight_calls, circuit_breakers
+    restart_logging_after_fork()
+    active_nacos_clients.clear()
+    nacos_config_cache = NacosConfigCache(**(config.get('nacos_cache') or {}))
+    _inherited_pools.extend(pool for _, pool in db_pools.values())
+    db_pools.clear()
+    env_contexts.clear()
+    balance_caches.clear()
+    member_caches.clear()
+    inflight_calls = SingleFlight()
+    circuit_breakers = BreakerRegistry(**(config.get('circuit_breaker') or {}))
+    warmup_status.update(state='pending', started_at=None, finished_at=None, envs={})
+    env_health.clear()
+    replica_router.reset()
+    logger.info("worker进程已重置Nacos客户端和数据库连接池, pid: %s", os.getpid())
+
+def get_balance_cache(client_key):
+    """环境对应的余额读缓存, 未启用时返回None"""
+    settings = config.get('balance_cache') or {}
+    if not settings.get('enabled'):
+        return None
+    cache = balance_caches.get(client_key)
+    if cache is None:
+        cache = balance_caches.setdefault(client_key, TTLCache(
+            max_entries=settings.get('max_entries', 10000),
+            ttl=settings.get('ttl', 5)
+        ))
+    return cache
+
+def get_member_cache(client_key):
+    """环境对应的 phone -> member_id 缓存"""
+    cache = member_caches.get(client_key)
+    if cache is None:
+        settings = config.get('member_cache') or {}
+        cache = member_caches.setdefault(client_key, TTLCache(
+            max_entries=settings.get('max_entries', 50000),
+            ttl=settings.get('ttl', 3600)
+        ))
+    return cache
+
+def query_balance(cursor, env, phone):
+    """查询余额, 返回 (balance, encrypt) 或 None
+
+    已缓存会员ID时只查资产表; 查不到时视为缓存过期, 回退到按手机号关联查询并重新缓存
+    """
+    members = get_member_cache(env.client_key)
+    member_id = members.get(phone)
+    if member_id is not None:
+        with timed_query('get_balance_by_member', env):
+            prepared.execute_prepared(cursor, 'get_balance_by_member', queries.GET_BALANCE_BY_MEMBER, (member_id,))
+            row = cursor.fetchone()
+        if row:
+            return row[0], row[1]
+        members.pop(phone)
+
+    with timed_query('get_balance', env):
+        prepared.execute_prepared(cursor, 'get_balance', queries.GET_BALANCE_WITH_MEMBER, (phone,))
+        row = cursor.fetchone()
+    if not row:
+        return None
+    members.set(phone, row[0])
+    return row[1], row[2]
+
+def apply_balance_update(cursor, env, phone, balance, balance_encrypt):
+    """更新余额, 返回 (balance, encrypt) 或 None(用户不存在), 会员ID缓存处理同 query_balance"""
+    members = get_member_cache(env.client_key)
+    member_id = members.get(phone)
+    if member_id is not None:
+        with timed_query('update_balance_by_member', env):
+            prepared.execute_prepared(
+                cursor, 'update_balance_by_member', queries.UPDATE_BALANCE_BY_MEMBER,
+                (balance, balance_encrypt, member_id)
+            )
+            row = cursor.fetchone()
+        if row:
+            return row[0], row[1]
+        members.pop(phone)
+
+    with timed_query('update_balance', env):
+        prepared.execute_prepared(cursor, 'update_balance', queries.UPDATE_BALANCE, (balance, balance_encrypt, phone))
+        row = cursor.fetchone()
+    if not row:
+        return None
+    members.set(phone, row[2])
+    return row[0], row[1]
+
 def calculate_md5(value):
     """计算余额的MD5值"""
     return hashlib.md5(str(value).encode()).hexdigest()
@@ -243,7 +690,7 @@ def load_config():
         with open(config_path, 'r', encoding='utf-8') as f:
             return yaml.safe_load(f)
     except Exception as e:
-        logger.error(f"加载配置文件失败: {str(e)}")
+        logger.error("加载配置文件失败: %s", e)
         # 返回默认配置
         return {
             'title': '瓴犀辅助工具'
@@ -251,60 +698,44 @@ def load_config():
 
 # 加载配置
 config = load_config()
+setup_logging(config.get('logging'))
+nacos_config_cache.configure(**(config.get('nacos_cache') or {}))
+circuit_breakers.configure(**(config.get('circuit_breaker') or {}))
+replica_router.configure(**(config.get('read_replicas') or {}))
 
 @app.route('/get_nacos_configs')
 def get_nacos_configs():
     """获取所有保存的Nacos配置"""
-    config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'nacos-data', 'nacos_configs.json')
     try:
-        with open(config_path, 'r', encoding='utf-8') as f:
-            configs = json.load(f)
-            return jsonify(configs)
-    except FileNotFoundError:
-        return jsonify([]), 200
-    except json.JSONDecodeError:
-        logger.error('nacos_configs.json文件格式错误')
-        logger.info(f"set_nacos_config接口响应 - success: {success}, message: {message}")
+        return jsonify(env_store.list())
+    except EnvStoreError as e:
+        logger.error("%s", e)
         return jsonify({'error': '配置文件格式错误'}), 500
     except Exception as e:
-        logger.error(f'读取配置文件失败: {str(e)}')
+        logger.error("读取配置文件失败: %s", e)
         return jsonify({'error': '读取配置失败'}), 500
 
 @app.route('/save_nacos_config', methods=['POST'])
 def save_nacos_config():
     """保存Nacos配置"""
-    config_data = request.json
+    config_data = request.get_json(silent=True)
+    if not isinstance(config_data, dict):
+        return jsonify({'success': False, 'message': '请求体必须是JSON对象'}), 400
     required_fields = ['server_addresses']
     for field in required_fields:
         if field not in config_data:
-            return jsonify({'error': f'缺少必要字段: {field}'}), 400
+            return jsonify({'success': False, 'message': f'缺少必要字段: {field}'}), 400
 
-    config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'nacos-data', 'nacos_configs.json')
     try:
-        # 读取现有配置
-        if os.path.exists(config_path):
-            with open(config_path, 'r', encoding='utf-8') as f:
-                configs = json.load(f)
-        else:
-            configs = []
-
-        # 检查是否已存在相同server的配置
-        existing_index = next((i for i, c in enumerate(configs) if c['server_addresses'] == config_data['server_addresses']), None)
-        if existing_index is not None:
-            # 更新现有配置
-            configs[existing_index] = config_data
-        else:
-            # 添加新配置
-            configs.append(config_data)
-
-        # 写入文件
-        with open(config_path, 'w', encoding='utf-8') as f:
-            json.dump(configs, f, ensure_ascii=False, indent=2)
-
+        # 已存在相同server的配置时覆盖, 否则追加
+        env_store.save(config_data)
         return jsonify({'success': True, 'message': '配置保存成功'})
+    except EnvStoreError as e:
+        logger.error("保存配置失败: %s", e)
+        return jsonify({'success': False, 'message': '配置文件格式错误'}), 500
     except Exception as e:
-        logger.error(f'保存配置失败: {str(e)}')
-        return jsonify({'error': '保存配置失败'}), 500
+        logger.error("保存配置失败: %s", e)
+        return jsonify({'success': False, 'message': '保存配置失败'}), 500
 
 @app.route('/')
 def index():
@@ -318,176 +749,156 @@ def index():
 
 
 
+@app.route('/get_gateway_url')
+@nacos_env(require_db=False)
+def get_gateway_url():
+    env = g.env
+    if not env.gateway_url:
+        return jsonify({
+            'success': False,
+            'message': '配置中缺少网关URL',
+            'details': f'当前配置: {json.dumps(dict(env.config), ensure_ascii=False)}'
+        }), 404
+
+    response = jsonify({
+        'success': True,
+        'gateway_url': env.gateway_url,
+        'message': '网关配置获取成功',
+        'server_info': env.server_info
+    })
+    response.set_etag(hashlib.md5(f"{env.client_key}|{env.config.get('version')}".encode()).hexdigest())
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
+
+def gateway_url_of(saved):
+    """解析一个已保存环境的网关地址, 返回 (client_key, 结果)"""
+    key = f"{saved.get('server_addresses')}_{saved.get('namespace')}"
+    try:
+        env = resolve_saved_env(saved)
+        key = env.client_key
+        if env.gateway_url:
+            item = {'status': 'ok', 'gateway_url': env.gateway_url, 'version': env.config.get('version')}
+        else:
+            item = {'status': 'error', 'message': '配置中缺少网关URL', 'version': env.config.get('version')}
+    except EnvResolveError as e:
+        item = {'status': 'error', 'message': e.message}
+    except Exception as e:
+        logger.warning("获取网关URL失败: %s, %s", key, e)
+        item = {'status': 'error', 'message': str(e)}
+    return key, item
+
+@app.route('/get_gateway_urls')
+def get_gateway_urls():
+    """一次返回所有(或 servers 指定的)已保存环境的网关地址
+
+    ETag 由各环境的配置版本生成, 配置未变化时返回304; 全部成功时允许浏览器缓存 max_age 秒
+    """
+    settings = config.get('gateway_urls') or {}
+    try:
+        saved = select_saved_envs(request.args.get('servers', ''))
+    except Exception as e:
+        logger.error("读取已保存的Nacos环境失败: %s", e)
+        return jsonify({'success': False, 'message': '读取已保存的环境失败'}), 500
+
+    timeout = float(settings.get('timeout', 5))
+    results, _ = run_in_parallel(gateway_url_of, saved, int(settings.get('max_workers', 8)), timeout, 'gateway')
+    gateways = []
+    for i, item in enumerate(saved):
+        key, result = results[i] if i in results else (
+            f"{item.get('server_addresses')}_{item.get('namespace')}",
+            {'status': 'timeout', 'message': f'{timeout}秒内未返回'}
+        )
+        gateways.append(dict(result, env=key, server_addresses=item.get('server_addresses'),
+                             namespace=item.get('namespace')))
+
+    response = jsonify({'success': True, 'data': gateways})
+    version = '|'.join(f"{gw['env']}:{gw['status']}:{gw.get('version')}" for gw in gateways)
+    response.set_etag(hashlib.md5(version.encode()).hexdigest())
+    complete = all(gw['status'] == 'ok' for gw in gateways)
+    max_age = int(settings.get('max_age', 30))
+    # 有环境失败或超时时不缓存, 下次请求重新获取
+    response.headers['Cache-Control'] = f'private, max-age={max_age}' if complete and max_age > 0 else 'private, no-cache'
+    return response.make_conditional(request)
+
 @app.route('/get_balance')
+@nacos_env()
 def get_balance():
     try:
         phone = request.args.get('phone')
-        server_address = request.args.get('server_address')
-        namespace = request.args.get('namespace', '')
-        username = request.args.get('username', 'nacos')
-        password = request.args.get('password', 'nacos')
-        
         if not phone:
             return jsonify({'success': False, 'message': '手机号不能为空'})
-        
-        # 如果有Nacos参数，则使用Nacos配置
-        if server_address:
-            # 规范化server_address
-            server_address = server_address.strip()
-            if ':' not in server_address:
-                server_address += ':8848'
-            
-            # 构建客户端key
-            client_key = f'{server_address}_{namespace}'
-            
-            # 检查是否需要初始化Nacos客户端
-            if client_key not in active_nacos_clients:
-                init_success = init_nacos_client(
-                    server_addresses=server_address,
-                    namespace=namespace,
-                    username=username,
-                    password=password
-                )
-                if not init_success:
-                    return jsonify({
-                        'success': False,
-                        'message': f'Nacos客户端初始化失败: {client_key}',
-                        'details': '请检查Nacos服务器地址、命名空间及凭据是否正确'
-                    }), 500
-            
-            # 获取Nacos配置
-            config = get_nacos_config(server_address, namespace)
-            if config and 'db_config' in config:
-                # 使用Nacos配置查询数据库
-                conn = get_db_connection_with_config(config)
-            else:
-                return jsonify({
-                    'success': False,
-                    'message': '无法从Nacos获取数据库配置',
-                    'details': '请检查common.yml是否包含正确的PostgreSQL配置'
-                })
 
-        
-        try:
-            with conn.cursor() as cursor:
-                # 查询余额
-                sql = """
-                SELECT account_balance, account_balance_encrypt
-                FROM pay_member_asset_account
-                WHERE member_id = (SELECT id FROM mem_member WHERE phone = %s)
-                """
-                cursor.execute(sql, (phone,))
-                result = cursor.fetchone()
-                
-                if not result:
-                    return jsonify({'success': False, 'message': '未找到用户余额信息'})
-                
-                # 确定环境名称
-                env_name = f"Nacos({server_address})" if server_address else "本地配置"
+        cache = get_balance_cache(g.env.client_key)
+        cached = cache.get(phone) if cache is not None else None
+        if cache is not None:
+            BALANCE_CACHE_REQUESTS.inc(env=g.env.client_key, result='miss' if cached is None else 'hit')
+
+        if cached is None:
+            with read_connection(g.env, phone) as conn:
+                with conn.cursor() as cursor:
+                    # 查询余额
+                    result = query_balance(cursor, g.env, phone)
                 
-                return jsonify({
-                    'success': True,
-                    'data': {
-                        'balance': float(result[0]),
-                        'encrypt': result[1],
-                        'environment': env_name
-                    }
-                })
-        finally:
-            conn.close()
+            if not result:
+                return jsonify({'success': False, 'message': '未找到用户余额信息'})
+            cached = (float(result[0]), result[1])
+            if cache is not None:
+                cache.set(phone, cached)
+
+        balance, encrypt = cached
+        response = jsonify({
+            'success': True,
+            'data': {
+                'balance': balance,
+                'encrypt': encrypt,
+                'environment': f"Nacos({g.env.server_address})"
+            }
+        })
+        # 客户端每次使用前携带 If-None-Match 重新验证, 余额未变化时返回304
+        response.set_etag(hashlib.md5(f'{balance}|{encrypt}'.encode()).hexdigest())
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response.make_conditional(request)
             
     except Exception as e:
-        logger.error(f"查询余额失败: {str(e)}")
+        logger.error("查询余额失败: %s", e)
         return jsonify({'success': False, 'message': str(e)})
 
 @app.route('/update_balance', methods=['POST'])
+@nacos_env()
 def update_balance():
     try:
         phone = request.form['phone']
         new_balance = float(request.form['balance'])
         balance_encrypt = calculate_md5(new_balance)
-        
-        # 从URL参数获取Nacos配置
-        server_address = request.args.get('server_address')
-        namespace = request.args.get('namespace')
-        username = request.args.get('username', 'nacos')
-        password = request.args.get('password', 'nacos')
-        
-        if not server_address or not namespace:
-            return jsonify({'success': False, 'message': '缺少必要参数: server_address和namespace'}), 400
-            
-        # 处理服务器地址格式
-        if ':' not in server_address:
-            server_address_with_port = f'{server_address}:8848'
-        else:
-            server_address_with_port = server_address
-            
-        # 获取Nacos配置
-        client_key = f'{server_address_with_port}_{namespace}'
-        if client_key not in active_nacos_clients:
-            init_success = init_nacos_client(
-                server_addresses=server_address_with_port,
-                namespace=namespace,
-                username=username,
-                password=password
-            )
-            if not init_success:
-                return jsonify({
-                    'success': False,
-                    'message': f'Nacos客户端初始化失败: {client_key}',
-                    'details': '请检查Nacos服务器地址、命名空间及凭据是否正确'
-                }), 500
-                
-        nacos_config = get_nacos_config(server_address_with_port, namespace)
-        if not nacos_config:
-            return jsonify({
-                'success': False,
-                'message': '未找到Nacos配置',
-                'details': f'配置路径: common.yml, 命名空间: {namespace}'
-            }), 404
-            
-        if 'db_config' not in nacos_config:
-            return jsonify({
-                'success': False,
-                'message': '配置中缺少数据库配置',
-                'details': '请检查common.yml是否包含正确的PostgreSQL配置'
-            }), 404
-            
-        # 使用配置获取数据库连接
-        conn = get_db_connection_with_config(nacos_config)
-        try:
+
+        with g.env.db.connection() as conn:
             with conn.cursor() as cursor:
-                # 先查询用户ID
-                sql_get_member = "SELECT id FROM mem_member WHERE phone = %s"
-                cursor.execute(sql_get_member, (phone,))
-                member = cursor.fetchone()
+                # 更新余额, 一条语句完成
+                updated = apply_balance_update(cursor, g.env, phone, new_balance, balance_encrypt)
                 
-                if not member:
+                if not updated:
+                    conn.rollback()
                     return jsonify({'success': False, 'message': '用户不存在'})
-                
-                # 更新余额
-                sql_update = """
-                UPDATE pay_member_asset_account 
-                SET account_balance = %s, account_balance_encrypt = %s 
-                WHERE member_id = %s
-                """
-                cursor.execute(sql_update, (new_balance, balance_encrypt, member[0]))
                 conn.commit()
+                record_write(g.env, conn, [phone])
+
+                # 写穿余额读缓存
+                cache = get_balance_cache(g.env.client_key)
+                if cache is not None:
+                    cache.set(phone, (float(updated[0]), updated[1]))
                 
                 return jsonify({
                     'success': True, 
                     'message': '余额更新成功',
                     'data': {
-                        'balance': new_balance,
-                        'encrypt': balance_encrypt,
-                        'server_info': f'{server_address_with_port} (namespace: {namespace})'
+                        'balance': float(updated[0]),
+                        'encrypt': updated[1],
+                        'server_info': g.env.server_info
                     }
                 })
-        finally:
-            conn.close()
             
     except Exception as e:
-        logger.error(f"更新余额失败: {str(e)}")
+        logger.error("更新余额失败: %s", e)
         return jsonify({'success': False, 'message': str(e)})
 
 
@@ -495,67 +906,741 @@ def update_balance():
 
 
 
+def compare_balance_in_env(phone, saved, cookies=None, timeout=None):
+    """在一个已保存环境中查询余额, 返回 (client_key, 结果), 异常转为结果中的状态
+
+    在工作线程中执行, cookies 由调用方从请求中传入; timeout 限制借连接和查询的时间
+    """
+    server_address = saved.get('server_addresses')
+    namespace = saved.get('namespace')
+    key = f"{server_address}_{namespace}"
+    started = time.perf_counter()
+    try:
+        env = resolve_saved_env(saved)
+        key = env.client_key
+        if 'db_config' not in env.config:
+            raise EnvResolveError('配置中缺少数据库配置', 404)
+        with read_connection(env, phone, cookies, timeout) as conn:
+            with conn.cursor() as cursor:
+                if timeout is not None:
+                    limit_statement_time(cursor, timeout)
+                result = query_balance(cursor, env, phone)
+        if result is None:
+            item = {'status': 'not_found'}
+        else:
+            balance = float(result[0])
+            item = {
+                'status': 'ok',
+                'balance': balance,
+                'encrypt': result[1],
+                'encrypt_valid': calculate_md5(balance) == result[1],
+            }
+    except EnvResolveError as e:
+        item = {'status': 'unavailable' if e.status == 503 else 'error', 'message': e.message}
+    except CircuitOpenError as e:
+        item = {'status': 'unavailable', 'message': str(e)}
+    except Exception as e:
+        logger.warning("对比余额时查询环境失败: %s, %s", key, e)
+        item = {'status': 'error', 'message': str(e)}
+    item.update(
+        server_address=server_address,
+        namespace=namespace,
+        latency_ms=round((time.perf_counter() - started) * 1000, 1)
+    )
+    return key, item
+
+@app.route('/compare_balance')
+def compare_balance():
+    """并行查询同一手机号在所有(或 servers 指定的)已保存环境中的余额
+
+    每个环境最多等待 timeout 秒, 超时或失败的环境单独标记, 其余环境的结果照常返回
+    """
+    phone = (request.args.get('phone') or '').strip()
+    if not phone:
+        return jsonify({'success': False, 'message': '手机号不能为空'}), 400
+
+    settings = config.get('compare_balance') or {}
+    try:
+        timeout = float(request.args.get('timeout', settings.get('timeout', 3)))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'timeout必须是数字'}), 400
+    timeout = min(max(timeout, 0.1), float(settings.get('max_timeout', 30)))
+
+    try:
+        saved = select_saved_envs(request.args.get('servers', ''))
+    except Exception as e:
+        logger.error("读取已保存的Nacos环境失败: %s", e)
+        return jsonify({'success': False, 'message': '读取已保存的环境失败'}), 500
+    if not saved:
+        return jsonify({'success': False, 'message': '没有可对比的环境'}), 404
+
+    results, _ = run_in_parallel(partial(compare_balance_in_env, phone, cookies=request.cookies.to_dict(), timeout=timeout), saved,
+                                 int(settings.get('max_workers', 8)), timeout, 'compare')
+    environments = []
+    for i, item in enumerate(saved):
+        if i in results:
+            key, result = results[i]
+        else:
+            key, result = f"{item.get('server_addresses')}_{item.get('namespace')}", {
+                'status': 'timeout',
+                'message': f'{timeout}秒内未返回',
+                'server_address': item.get('server_addresses'),
+                'namespace': item.get('namespace'),
+            }
+        environments.append(dict(result, env=key))
+
+    balances = {e['balance'] for e in environments if e['status'] == 'ok'}
+    summary = {status: 0 for status in ('ok', 'not_found', 'error', 'unavailable', 'timeout')}
+    for e in environments:
+        summary[e['status']] += 1
+    return jsonify({
+        'success': True,
+        'data': {
+            'phone': phone,
+            'environments': environments,
+            'summary': dict(summary, total=len(environments), consistent=len(balances) <= 1)
+        }
+    })
+
+def read_phone_list():
+    """从请求体读取手机号列表, 支持JSON数组/{"phones": [...]}/每行一个的纯文本, 去重并保持顺序"""
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get('phones')
+        if data is None:
+            raise ValueError('JSON请求体缺少phones字段')
+    elif data is None:
+        data = request.get_data(as_text=True).replace(',', '\n').splitlines()
+    if not isinstance(data, list):
+        raise ValueError('phones必须是数组')
+    phones = [str(p).strip() for p in data if str(p).strip()]
+    return list(dict.fromkeys(phones))
+
+@app.route('/batch_get_balance', methods=['POST'])
+@nacos_env()
+def batch_get_balance():
+    """批量查询余额, 以NDJSON分块流式返回, 最后一行为汇总(含未找到的手机号)
+
+    启用余额读缓存时先输出缓存命中的手机号, 只查询未命中的部分
+    """
+    batch_config = config.get('batch') or {}
+    max_phones = int(batch_config.get('max_phones', 50000))
+    chunk_size = int(batch_config.get('chunk_size', 1000))
+
+    try:
+        phones = read_phone_list()
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    if not phones:
+        return jsonify({'success': False, 'message': '手机号列表不能为空'}), 400
+    if len(phones) > max_phones:
+        return jsonify({'success': False, 'message': f'单次最多查询{max_phones}个手机号'}), 400
+
+    env = g.env
+    members = get_member_cache(g.env.client_key)
+    cache = get_balance_cache(g.env.client_key)
+    cached = {}
+    if cache is not None:
+        cached = cache.get_many(phones)
+        BALANCE_CACHE_REQUESTS.inc(len(cached), env=g.env.client_key, result='hit')
+        BALANCE_CACHE_REQUESTS.inc(len(phones) - len(cached), env=g.env.client_key, result='miss')
+    pending = [p for p in phones if p not in cached]
+
+    def query_pending(found):
+        """查询缓存未命中的手机号, 按块产出NDJSON"""
+        with read_connection(env, phones=pending) as conn:
+            # 服务端命名游标, 按块拉取结果, 避免一次性加载全部行
+            with conn.cursor(name='batch_get_balance') as cursor:
+                cursor.itersize = chunk_size
+                cursor.execute(queries.BATCH_GET_BALANCE, (pending,))
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    lines = []
+                    members.set_many((row[0], row[3]) for row in rows)
+                    if cache is not None:
+                        cache.set_many((row[0], (float(row[1]), row[2])) for row in rows)
+                    for phone, balance, encrypt, _ in rows:
+                        found.add(phone)
+                        lines.append(json.dumps({
+                            'phone': phone,
+                            'balance': float(balance),
+                            'encrypt': encrypt
+                        }, ensure_ascii=False))
+                    yield '\n'.join(lines) + '\n'
+
+    def generate():
+        found = set(cached)
+        items = list(cached.items())
+        for start in range(0, len(items), chunk_size):
+            yield '\n'.join(json.dumps({
+                'phone': phone,
+                'balance': balance,
+                'encrypt': encrypt
+            }, ensure_ascii=False) for phone, (balance, encrypt) in items[start:start + chunk_size]) + '\n'
+
+        try:
+            if pending:
+                yield from query_pending(found)
+        except Exception as e:
+            logger.error("批量查询余额失败: %s", e)
+            yield json.dumps({'success': False, 'message': str(e)}, ensure_ascii=False) + '\n'
+            return
+
+        missing = [p for p in phones if p not in found]
+        yield json.dumps({
+            'success': True,
+            'summary': {'requested': len(phones), 'found': len(found), 'missing': missing}
+        }, ensure_ascii=False) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/export_balance')
+@nacos_env()
+def export_balance():
+    """流式导出环境内所有会员的手机号、余额和余额MD5, format=csv(默认)或ndjson
+
+    服务端命名游标按块读取, 每块写出后即释放, 内存占用与总行数无关
+    """
+    fmt = request.args.get('format', 'csv').lower()
+    if fmt not in ('csv', 'ndjson'):
+        return jsonify({'success': False, 'message': 'format只支持csv或ndjson'}), 400
+    chunk_size = int((config.get('export') or {}).get('chunk_size', 5000))
+    env = g.env
+
+    def generate():
+        rows_written = 0
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if fmt == 'csv':
+            writer.writerow(('phone', 'balance', 'encrypt'))
+        try:
+            with read_connection(env) as conn:
+                with conn.cursor(name='export_balance') as cursor:
+                    cursor.itersize = chunk_size
+                    cursor.execute(queries.EXPORT_BALANCE)
+                    while True:
+                        rows = cursor.fetchmany(chunk_size)
+                        if not rows:
+                            break
+                        if fmt == 'csv':
+                            writer.writerows((phone, float(balance), encrypt) for phone, balance, encrypt in rows)
+                        else:
+                            for phone, balance, encrypt in rows:
+                                buffer.write(json.dumps({
+                                    'phone': phone,
+                                    'balance': float(balance),
+                                    'encrypt': encrypt
+                                }, ensure_ascii=False))
+                                buffer.write('\n')
+                        rows_written += len(rows)
+                        yield buffer.getvalue()
+                        buffer.seek(0)
+                        buffer.truncate()
+        except Exception as e:
+            logger.error("导出余额失败: %s, 已导出%s行, %s", env.client_key, rows_written, e)
+            if fmt == 'csv':
+                # CSV没有错误行格式, 中断响应让客户端感知导出不完整
+                raise
+            yield json.dumps({'success': False, 'message': str(e), 'rows': rows_written}, ensure_ascii=False) + '\n'
+            return
+
+        if fmt == 'csv':
+            yield buffer.getvalue()
+        else:
+            yield json.dumps({'success': True, 'summary': {'rows': rows_written}}, ensure_ascii=False) + '\n'
+        logger.info("导出余额完成: %s, %s行", env.client_key, rows_written)
+
+    filename = f"balances-{env.namespace}-{time.strftime('%Y%m%d%H%M%S')}.{fmt}"
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(
+        stream_with_context(generate()),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+def read_request_rows(value_field, parse_value, expected_keys='rows'):
+    """读取批量请求体中的 (手机号, 值) 行, 支持JSON([{"phone", value_field}] 或 {"rows": [...]})
+    和CSV(phone,值, 可带表头, 可作为 file 上传)
+
+    parse_value 转换每行的值, 抛出 ValueError 时该行记为无效, 异常信息作为原因;
+    JSON对象缺少rows字段时抛出 ValueError, 提示中的字段名为 expected_keys
+
+    返回 (rows, invalid), rows 为 {phone: 值}, 重复手机号以最后一行为准
+    """
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get('rows')
+        if data is None:
+            raise ValueError(f'JSON请求体缺少{expected_keys}字段')
+    elif data is None:
+        upload = request.files.get('file')
+        text = upload.read().decode('utf-8-sig') if upload else request.get_data(as_text=True)
+        data = [r for r in csv.reader(io.StringIO(text)) if r and any(c.strip() for c in r)]
+        # 跳过表头
+        if data and data[0][0].strip().lower() == 'phone':
+            data = data[1:]
+    if not isinstance(data, list):
+        raise ValueError('rows必须是数组')
+
+    rows = {}
+    invalid = []
+    for index, item in enumerate(data, start=1):
+        if isinstance(item, dict):
+            phone, value = item.get('phone'), item.get(value_field)
+        elif isinstance(item, (list, tuple)) and len(item) >= 2:
+            phone, value = item[0], item[1]
+        else:
+            invalid.append({'row': index, 'message': '格式错误'})
+            continue
+        phone = str(phone or '').strip()
+        if not phone:
+            invalid.append({'row': index, 'message': '手机号不能为空'})
+            continue
+        try:
+            rows[phone] = parse_value(value)
+        except ValueError as e:
+            invalid.append({'row': index, 'phone': phone, 'message': str(e)})
+    return rows, invalid
+
+def _parse_balance(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValueError('余额不是有效数字')
+
+def read_balance_rows():
+    """读取批量余额更新数据, 格式见 read_request_rows(phone,balance), 返回 (rows, invalid)"""
+    return read_request_rows('balance', _parse_balance)
+
+@app.route('/batch_update_balance', methods=['POST'])
+@nacos_env()
+def batch_update_balance():
+    """批量更新余额: 写入临时表后用一条 UPDATE ... FROM 在单个事务中完成"""
+    batch_config = config.get('batch') or {}
+    max_rows = int(batch_config.get('max_update_rows', 500000))
+    page_size = int(batch_config.get('chunk_size', 1000))
+
+    try:
+        rows, invalid = read_balance_rows()
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    if not rows:
+        return jsonify({'success': False, 'message': '没有有效的更新数据', 'invalid': invalid}), 400
+    if len(rows) > max_rows:
+        return jsonify({'success': False, 'message': f'单次最多更新{max_rows}行'}), 400
+
+    client_key = g.env.client_key
+    try:
+        values = [(phone, balance, calculate_md5(balance)) for phone, balance in rows.items()]
+        with g.env.db.connection() as conn:
+            with conn.cursor() as cursor:
+                with timed_query('batch_update_balance'):
+                    cursor.execute(queries.CREATE_TMP_BALANCE_UPDATE)
+                    execute_values(
+                        cursor,
+                        queries.INSERT_TMP_BALANCE_UPDATE,
+                        values,
+                        page_size=page_size
+                    )
+                    cursor.execute(queries.APPLY_TMP_BALANCE_UPDATE)
+                    member_ids = dict(cursor.fetchall())
+                    updated = list(member_ids)
+            conn.commit()
+            record_write(g.env, conn, updated)
+    except Exception as e:
+        logger.error("批量更新余额失败: %s", e)
+        return jsonify({'success': False, 'message': str(e)})
+
+    updated_set = set(updated)
+    get_member_cache(client_key).set_many(member_ids.items())
+    cache = get_balance_cache(client_key)
+    if cache is not None:
+        cache.set_many((phone, (balance, encrypt)) for phone, balance, encrypt in values if phone in updated_set)
+    missing = [phone for phone in rows if phone not in updated_set]
+    logger.info("批量更新余额完成: %s, 更新%s行, 未找到%s个, 无效%s行", client_key, len(updated), len(missing), len(invalid))
+    return jsonify({
+        'success': True,
+        'message': '批量更新完成',
+        'data': {
+            'requested': len(rows),
+            'updated_count': len(updated),
+            'updated': updated,
+            'missing': missing,
+            'invalid': invalid
+        }
+    })
+
 @app.route('/health')
+@nacos_env(error_style='status')
 def health_check():
     """健康检查端点"""
     try:
-        # 从URL参数获取Nacos配置
-        server_address = request.args.get('server_address')
-        namespace = request.args.get('namespace')
-        username = request.args.get('username', 'nacos')
-        password = request.args.get('password', 'nacos')
-        
-        if not server_address or not namespace:
-            return jsonify({
-                'status': 'error',
-                'message': '缺少必要参数: server_address和namespace'
-            }), 400
-            
-        # 处理服务器地址格式
-        if ':' not in server_address:
-            server_address_with_port = f'{server_address}:8848'
-        else:
-            server_address_with_port = server_address
-            
-        # 获取Nacos配置
-        client_key = f'{server_address_with_port}_{namespace}'
-        if client_key not in active_nacos_clients:
-            init_success = init_nacos_client(
-                server_addresses=server_address_with_port,
-                namespace=namespace,
-                username=username,
-                password=password
-            )
-            if not init_success:
-                return jsonify({
-                    'status': 'error',
-                    'message': f'Nacos客户端初始化失败: {client_key}'
-                }), 500
-                
-        nacos_config = get_nacos_config(server_address_with_port, namespace)
-        if not nacos_config or 'db_config' not in nacos_config:
-            return jsonify({
-                'status': 'error',
-                'message': '未找到有效的数据库配置'
-            }), 404
-            
         # 检查数据库连接
-        conn = get_db_connection_with_config(nacos_config)
-        conn.close()
+        with read_connection(g.env) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
         
         return jsonify({
             'status': 'ok',
+            'breakers': circuit_breakers.snapshot(),
+            'replicas': replica_router.snapshot([key for key, _ in g.env.replicas]),
             'message': '服务运行正常',
-            'server_info': f'{server_address_with_port} (namespace: {namespace})'
+            'server_info': g.env.server_info
         })
+    except CircuitOpenError as e:
+        logger.warning("健康检查快速失败: %s", e)
+        return jsonify({
+            'status': 'error',
+            'breakers': circuit_breakers.snapshot(),
+            'message': str(e)
+        }), 503
     except Exception as e:
-        logger.error(f"健康检查失败: {str(e)}")
+        logger.error("健康检查失败: %s", e)
         return jsonify({
             'status': 'error',
+            'breakers': circuit_breakers.snapshot(),
             'message': str(e)
         }), 500
 
+# 启动预热状态, 预热完成(或未启用)前 /readyz 返回503
+warmup_status = {'state': 'pending', 'started_at': None, 'finished_at': None, 'envs': {}}
+# 各环境就绪状态快照 - client_key: {'status', 'latency_ms', 'checked_at', 'error'}, 由后台线程定期刷新
+env_health = {}
+_warmup_lock = threading.Lock()
+
+def load_saved_envs():
+    return [c for c in env_store.list() if isinstance(c, dict)]
+
+def select_saved_envs(servers):
+    """servers 为逗号分隔的 server_addresses, 为空时返回全部已保存环境, 否则按索引查找, 未保存的地址忽略"""
+    servers = [s.strip() for s in servers.split(',') if s.strip()]
+    if not servers:
+        return load_saved_envs()
+    return [c for c in (env_store.get(s) for s in dict.fromkeys(servers)) if isinstance(c, dict)]
+
+def resolve_saved_env(saved):
+    """解析 nacos_configs.json 中的一条环境记录"""
+    return resolve_env(
+        saved.get('server_addresses', ''),
+        saved.get('namespace'),
+        username=saved.get('username', 'nacos'),
+        password=saved.get('password', 'nacos'),
+        require_db=False
+    )
+
+def warm_up_env(saved):
+    """预热一个已保存的环境: 创建Nacos客户端、拉取并解析配置、打开连接池, 返回 client_key"""
+    env = resolve_saved_env(saved)
+    if 'db_config' in env.config:
+        # 连接池按 min_size 预建连接, 再借还一次确认可用
+        with env.db.connection():
+            pass
+    return env.client_key
+
+def _warm_up_one(saved):
+    key = f"{saved.get('server_addresses')}_{saved.get('namespace')}"
+    started = time.perf_counter()
+    try:
+        key = warm_up_env(saved)
+        result = {'ok': True}
+    except EnvResolveError as e:
+        result = {'ok': False, 'error': e.message}
+    except Exception as e:
+        result = {'ok': False, 'error': str(e)}
+    result['seconds'] = round(time.perf_counter() - started, 3)
+    with _warmup_lock:
+        warmup_status['envs'][key] = result
+    if not result['ok']:
+        logger.warning("预热环境失败: %s, %s", key, result['error'])
+
+def run_in_parallel(fn, items, max_workers, timeout, thread_name_prefix, total_timeout=None):
+    """最多 max_workers 个线程并行执行 fn(item), 返回 (已完成的 {下标: 结果}, 是否有任务超时)
+
+    每个任务从开始执行起计时, 超过 timeout 秒不再等待, 其并发名额立即让给排队的任务, 超时不会拖累排在后面的环境;
+    超时任务的线程在后台自行结束, fn 应把超时传给连接池和SQL以尽快释放连接.
+    total_timeout 为整体等待上限, 到期后未完成和未开始的任务都不再等待
+    """
+    results = {}
+    pending = deque(enumerate(items))
+    finished = queue.Queue()
+    # 下标: 开始时间
+    running = {}
+    timed_out = False
+    now = time.monotonic()
+    give_up_at = None if total_timeout is None else now + total_timeout
+
+    def run(i, item):
+        try:
+            finished.put((i, fn(item), None))
+        except BaseException as e:
+            finished.put((i, None, e))
+
+    while pending or running:
+        while pending and len(running) < max(1, max_workers):
+            i, item = pending.popleft()
+            running[i] = time.monotonic()
+            threading.Thread(target=run, args=(i, item), name=f'{thread_name_prefix}-{i}', daemon=True).start()
+        wake_at = min(running.values()) + timeout
+        if give_up_at is not None:
+            wake_at = min(wake_at, give_up_at)
+        try:
+            i, result, error = finished.get(timeout=max(0, wake_at - time.monotonic()))
+        except queue.Empty:
+            now = time.monotonic()
+            if give_up_at is not None and now >= give_up_at:
+                return results, True
+            for i, started in list(running.items()):
+                if now - started >= timeout:
+                    del running[i]
+                    timed_out = True
+            continue
+        if running.pop(i, None) is None:
+            # 已按超时放弃的任务
+            continue
+        if error is not None:
+            raise error
+        results[i] = result
+    return results, timed_out
+
+def run_warmup(settings):
+    """并行预热 nacos_configs.json 中的所有环境"""
+    try:
+        saved = load_saved_envs()
+    except Exception as e:
+        logger.error("读取已保存的Nacos环境失败, 跳过预热: %s", e)
+        saved = []
+
+    started = time.perf_counter()
+    timeout = float(settings.get('timeout', 60))
+    _, timed_out = run_in_parallel(_warm_up_one, saved, int(settings.get('max_workers', 8)),
+                                   timeout, 'warmup', total_timeout=timeout)
+    if timed_out:
+        logger.warning("启动预热超时, 剩余环境在首次请求时初始化")
+
+    with _warmup_lock:
+        warmup_status['state'] = 'done'
+        warmup_status['finished_at'] = time.time()
+        ok = sum(1 for r in warmup_status['envs'].values() if r['ok'])
+    logger.info("启动预热完成: %s/%s个环境, 耗时%.2fs", ok, len(saved), time.perf_counter() - started)
+
+def check_env(saved, timeout=None):
+    """检查一个已保存环境: 配置使用缓存, 数据库通过连接池执行 SELECT 1, 熔断打开时直接返回错误
+
+    timeout 限制借连接和 SELECT 1 的时间
+    """
+    key = f"{saved.get('server_addresses')}_{saved.get('namespace')}"
+    started = time.perf_counter()
+    try:
+        env = resolve_saved_env(saved)
+        key = env.client_key
+        if 'db_config' in env.config:
+            with env.db.connection(timeout) as conn:
+                with conn.cursor() as cursor:
+                    if timeout is not None:
+                        limit_statement_time(cursor, timeout)
+                    cursor.execute('SELECT 1')
+        result = {'status': 'ok'}
+    except EnvResolveError as e:
+        result = {'status': 'error', 'error': e.message}
+    except Exception as e:
+        result = {'status': 'error', 'error': str(e)}
+    result['latency_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    result['checked_at'] = time.time()
+    return key, result
+
+def probe_all_envs():
+    """并行检查所有已保存的环境并替换状态快照, 并发调用共享同一轮检查"""
+    return inflight_calls.do(('probe_all_envs',), _probe_all_envs)
+
+def _probe_all_envs():
+    settings = config.get('readiness') or {}
+    saved = load_saved_envs()
+    timeout = float(settings.get('timeout', 5))
+    results, _ = run_in_parallel(partial(check_env, timeout=timeout), saved, int(settings.get('max_workers', 8)),
+                                 timeout, 'readiness')
+    snapshot = {}
+    now = time.time()
+    for i, item in enumerate(saved):
+        if i in results:
+            key, result = results[i]
+        else:
+            key = f"{item.get('server_addresses')}_{item.get('namespace')}"
+            result = {'status': 'timeout', 'checked_at': now}
+        snapshot[key] = result
+    with _warmup_lock:
+        env_health.clear()
+        env_health.update(snapshot)
+    return snapshot
+
+def run_background_checks(settings):
+    """定期刷新各环境状态快照, interval 为0时不检查"""
+    interval = float(settings.get('interval', 15))
+    while interval > 0:
+        try:
+            probe_all_envs()
+        except Exception as e:
+            logger.error("检查环境状态失败: %s", e)
+        time.sleep(interval)
+
+def _startup_tasks(warmup_settings, readiness_settings):
+    if warmup_settings is not None:
+        run_warmup(warmup_settings)
+    run_background_checks(readiness_settings)
+
+def start_warmup():
+    """在后台线程中预热, 完成后在同一线程中定期检查各环境状态; 每个进程只执行一次, 返回是否启动"""
+    settings = config.get('warmup') or {}
+    enabled = settings.get('enabled', True)
+    with _warmup_lock:
+        if warmup_status['state'] != 'pending':
+            return False
+        warmup_status['state'] = 'running' if enabled else 'disabled'
+        warmup_status['started_at'] = time.time()
+    threading.Thread(
+        target=_startup_tasks,
+        args=(settings if enabled else None, config.get('readiness') or {}),
+        name='warmup', daemon=True
+    ).start()
+    return True
+
+@app.route('/livez')
+def livez():
+    """存活探针, 不访问Nacos和数据库"""
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz')
+def readyz():
+    """就绪探针, 返回后台检查缓存的各环境状态, 启动预热完成前返回503
+
+    ?probe=1 时立即并行检查所有已保存的环境后返回
+    """
+    # 未经 gunicorn post_fork 或 __main__ 启动时(如 flask run), 由首次探测触发预热
+    start_warmup()
+    if request.args.get('probe', '').lower() in ('1', 'true'):
+        try:
+            probe_all_envs()
+        except Exception as e:
+            logger.error("检查环境状态失败: %s", e)
+    with _warmup_lock:
+        warmup = dict(warmup_status, envs=dict(warmup_status['envs']))
+        envs = {key: dict(result) for key, result in env_health.items()}
+    ready = warmup['state'] in ('done', 'disabled')
+    return jsonify({
+        'status': 'ok' if ready else 'warming_up',
+        'warmup': warmup,
+        'envs': envs,
+        'summary': {
+            'total': len(envs),
+            'ok': sum(1 for r in envs.values() if r['status'] == 'ok'),
+        }
+    }), 200 if ready else 503
+
+@app.route('/admin/nacos_cache')
+def nacos_cache_stats():
+    """Nacos配置缓存统计"""
+    return jsonify({'success': True, 'data': nacos_config_cache.stats()})
+
+@app.route('/admin/nacos_cache/invalidate', methods=['POST'])
+def invalidate_nacos_cache():
+    """使单个环境的Nacos配置缓存失效, 下次请求重新从Nacos获取"""
+    params = request.get_json(silent=True) or request.form or request.args
+    server_address = (params.get('server_address') or '').strip()
+    namespace = params.get('namespace')
+    if not server_address or namespace is None:
+        return jsonify({'success': False, 'message': '缺少必要参数: server_address和namespace'}), 400
+    _, client_key = normalize_server_address(server_address, namespace)
+
+    removed = nacos_config_cache.invalidate(client_key)
+    env_contexts.pop(client_key, None)
+    logger.info("Nacos配置缓存失效: %s, 是否存在: %s", client_key, removed)
+    return jsonify({
+        'success': True,
+        'message': '缓存已失效' if removed else '缓存中不存在该环境',
+        'client_key': client_key
+    })
+
+@metrics_registry.add_collector
+def collect_pool_and_breaker_metrics():
+    pool_stats = [(key, pool.stats()) for key, (_, pool) in list(db_pools.items())]
+    lines = gauge_lines(
+        'balance_db_pool_connections', '连接池当前连接数',
+        [({'env': key, 'state': state}, stats[state]) for key, stats in pool_stats for state in ('in_use', 'idle')]
+    )
+    lines += gauge_lines(
+        'balance_db_pool_max_connections', '连接池最大连接数',
+        [({'env': key}, stats['max_size']) for key, stats in pool_stats]
+    )
+    lines += gauge_lines(
+        'balance_db_pool_events_total', '连接池事件累计次数',
+        [({'env': key, 'event': event}, stats[event]) for key, stats in pool_stats
+         for event in ('created', 'destroyed', 'borrowed', 'waits', 'timeouts', 'health_check_failures', 'evicted_idle')],
+        type_name='counter'
+    )
+    breakers = circuit_breakers.snapshot()
+    states = (CircuitBreaker.CLOSED, CircuitBreaker.OPEN, CircuitBreaker.HALF_OPEN)
+    lines += gauge_lines(
+        'balance_circuit_breaker_state', '熔断器状态(当前状态为1)',
+        [({'breaker': name, 'state': state}, int(snap['state'] == state)) for name, snap in breakers.items() for state in states]
+    )
+    lines += gauge_lines(
+        'balance_circuit_breaker_rejected_total', '熔断器快速失败次数',
+        [({'breaker': name}, snap['rejected']) for name, snap in breakers.items()],
+        type_name='counter'
+    )
+    lines += gauge_lines(
+        'balance_balance_cache_entries', '余额读缓存条目数',
+        [({'env': key}, len(cache)) for key, cache in list(balance_caches.items())]
+    )
+    statement_stats = prepared.stats()
+    lines += gauge_lines(
+        'balance_prepared_statement_executions_total', '预处理语句执行次数(hit为复用已PREPARE的语句)',
+        [({'statement': name, 'result': result}, counts[field])
+         for name, counts in statement_stats['statements'].items()
+         for result, field in (('hit', 'hits'), ('miss', 'misses'))],
+        type_name='counter'
+    )
+    lines += gauge_lines(
+        'balance_prepared_statement_invalidated_total', '服务端已不存在而失效的预处理语句次数',
+        [({}, statement_stats['invalidated'])],
+        type_name='counter'
+    )
+    cache_stats = nacos_config_cache.stats()
+    lines += gauge_lines('balance_nacos_config_cache_entries', 'Nacos配置缓存的环境数', [({}, cache_stats['size'])])
+    lines += gauge_lines(
+        'balance_nacos_config_cache_refreshes_total', 'Nacos配置后台刷新次数',
+        [({'result': 'ok'}, cache_stats['refreshes'] - cache_stats['refresh_failures']),
+         ({'result': 'failed'}, cache_stats['refresh_failures'])],
+        type_name='counter'
+    )
+    return lines
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus格式指标"""
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/admin/balance_cache')
+def balance_cache_stats():
+    """各环境余额读缓存统计(含命中率)"""
+    return jsonify({
+        'success': True,
+        'enabled': bool((config.get('balance_cache') or {}).get('enabled')),
+        'data': {key: cache.stats() for key, cache in list(balance_caches.items())}
+    })
+
+@app.route('/db_pool_stats')
+def db_pool_stats():
+    """各环境数据库连接池统计"""
+    return jsonify({
+        'success': True,
+        'data': {key: pool.stats() for key, (_, pool) in list(db_pools.items())},
+        'prepared_statements': prepared.stats()
+    })
+
 @app.route('/verify_password', methods=['POST'])
+@nacos_env()
 def verify_password():
     try:
         phone = request.form['phone']
@@ -563,61 +1648,13 @@ def verify_password():
         
         # 计算输入密码的MD5值
         password_md5 = calculate_password_md5(password)
-        
-        # 从URL参数获取Nacos配置
-        server_address = request.args.get('server_address')
-        namespace = request.args.get('namespace')
-        username = request.args.get('username', 'nacos')
-        password = request.args.get('password', 'nacos')
-        
-        if not server_address or not namespace:
-            return jsonify({'success': False, 'message': '缺少必要参数: server_address和namespace'}), 400
-            
-        # 处理服务器地址格式
-        if ':' not in server_address:
-            server_address_with_port = f'{server_address}:8848'
-        else:
-            server_address_with_port = server_address
-            
-        # 获取Nacos配置
-        client_key = f'{server_address_with_port}_{namespace}'
-        if client_key not in active_nacos_clients:
-            init_success = init_nacos_client(
-                server_addresses=server_address_with_port,
-                namespace=namespace,
-                username=username,
-                password=password
-            )
-            if not init_success:
-                return jsonify({
-                    'success': False,
-                    'message': f'Nacos客户端初始化失败: {client_key}',
-                    'details': '请检查Nacos服务器地址、命名空间及凭据是否正确'
-                }), 500
-                
-        nacos_config = get_nacos_config(server_address_with_port, namespace)
-        if not nacos_config:
-            return jsonify({
-                'success': False,
-                'message': '未找到Nacos配置',
-                'details': f'配置路径: common.yml, 命名空间: {namespace}'
-            }), 404
-            
-        if 'db_config' not in nacos_config:
-            return jsonify({
-                'success': False,
-                'message': '配置中缺少数据库配置',
-                'details': '请检查common.yml是否包含正确的PostgreSQL配置'
-            }), 404
-            
-        # 使用配置获取数据库连接
-        conn = get_db_connection_with_config(nacos_config)
-        try:
+
+        with read_connection(g.env, phone) as conn:
             with conn.cursor() as cursor:
                 # 查询用户密码
-                sql = "SELECT password FROM mem_user WHERE phone = %s"
-                cursor.execute(sql, (phone,))
-                result = cursor.fetchone()
+                with timed_query('get_password'):
+                    prepared.execute_prepared(cursor, 'get_password', queries.GET_PASSWORD, (phone,))
+                    result = cursor.fetchone()
                 
                 if not result:
                     return jsonify({'success': False, 'message': '未找到用户信息'})
@@ -634,14 +1671,13 @@ def verify_password():
                         'success': False,
                         'message': '密码不正确'
                     })
-        finally:
-            conn.close()
             
     except Exception as e:
-        logger.error(f"验证密码失败: {str(e)}")
+        logger.error("验证密码失败: %s", e)
         return jsonify({'success': False, 'message': str(e)})
 
 @app.route('/update_password', methods=['POST'])
+@nacos_env()
 def update_password():
     try:
         phone = request.form['phone']
@@ -649,81 +1685,164 @@ def update_password():
         
         # 计算新密码的MD5值
         new_password_md5 = calculate_password_md5(new_password)
-        
-        # 从URL参数获取Nacos配置
-        server_address = request.args.get('server_address')
-        namespace = request.args.get('namespace')
-        username = request.args.get('username', 'nacos')
-        password = request.args.get('password', 'nacos')
-        
-        if not server_address or not namespace:
-            return jsonify({'success': False, 'message': '缺少必要参数: server_address和namespace'}), 400
-            
-        # 处理服务器地址格式
-        if ':' not in server_address:
-            server_address_with_port = f'{server_address}:8848'
-        else:
-            server_address_with_port = server_address
-            
-        # 获取Nacos配置
-        client_key = f'{server_address_with_port}_{namespace}'
-        if client_key not in active_nacos_clients:
-            init_success = init_nacos_client(
-                server_addresses=server_address_with_port,
-                namespace=namespace,
-                username=username,
-                password=password
-            )
-            if not init_success:
-                return jsonify({
-                    'success': False,
-                    'message': f'Nacos客户端初始化失败: {client_key}',
-                    'details': '请检查Nacos服务器地址、命名空间及凭据是否正确'
-                }), 500
-                
-        nacos_config = get_nacos_config(server_address_with_port, namespace)
-        if not nacos_config:
-            return jsonify({
-                'success': False,
-                'message': '未找到Nacos配置',
-                'details': f'配置路径: common.yml, 命名空间: {namespace}'
-            }), 404
-            
-        if 'db_config' not in nacos_config:
-            return jsonify({
-                'success': False,
-                'message': '配置中缺少数据库配置',
-                'details': '请检查common.yml是否包含正确的PostgreSQL配置'
-            }), 404
-            
-        # 使用配置获取数据库连接
-        conn = get_db_connection_with_config(nacos_config)
-        try:
+
+        with g.env.db.connection() as conn:
             with conn.cursor() as cursor:
                 # 更新密码
-                sql_update = "UPDATE mem_user SET password = %s WHERE phone = %s"
-                cursor.execute(sql_update, (new_password_md5, phone))
+                with timed_query('update_password'):
+                    prepared.execute_prepared(cursor, 'update_password', queries.UPDATE_PASSWORD, (new_password_md5, phone))
                 affected_rows = cursor.rowcount
                 
                 if affected_rows == 0:
                     return jsonify({'success': False, 'message': '用户不存在'})
                     
                 conn.commit()
+                record_write(g.env, conn, [phone])
                 return jsonify({
                     'success': True,
                     'message': '密码修改成功'
                 })
-        finally:
-            conn.close()
             
     except Exception as e:
-        logger.error(f"修改密码失败: {str(e)}")
+        logger.error("修改密码失败: %s", e)
+        return jsonify({'success': False, 'message': str(e)})
+
+def _parse_password(value):
+    if not isinstance(value, str) or not value:
+        raise ValueError('密码不能为空')
+    return value
+
+def read_password_rows(password_field):
+    """读取批量密码数据, 支持:
+    - {"phones": [...], password_field: "..."}: 所有手机号使用同一个密码
+    - 逐行给出密码, 格式见 read_request_rows(phone,密码)
+
+    返回 (rows, invalid), rows 为 {phone: 明文密码}, 重复手机号以最后一行为准
+    """
+    data = request.get_json(silent=True)
+    if isinstance(data, dict) and 'phones' in data:
+        password = data.get(password_field)
+        if not isinstance(data['phones'], list) or not isinstance(password, str) or not password:
+            raise ValueError(f'phones必须是数组且{password_field}不能为空')
+        return {str(p).strip(): password for p in data['phones'] if str(p).strip()}, []
+    return read_request_rows(password_field, _parse_password, expected_keys='phones或rows')
+
+def hash_passwords(rows):
+    """批量计算密码MD5, 相同的明文只计算一次"""
+    hashed = {}
+    result = {}
+    for phone, password in rows.items():
+        if password not in hashed:
+            hashed[password] = calculate_password_md5(password)
+        result[phone] = hashed[password]
+    return result
+
+def load_password_batch(password_field):
+    """读取并校验批量密码请求, 返回 (rows, invalid, 错误响应)"""
+    max_rows = int((config.get('batch') or {}).get('max_password_rows', 50000))
+    try:
+        rows, invalid = read_password_rows(password_field)
+    except ValueError as e:
+        return None, None, (jsonify({'success': False, 'message': str(e)}), 400)
+    if not rows:
+        return None, None, (jsonify({'success': False, 'message': '没有有效的数据', 'invalid': invalid}), 400)
+    if len(rows) > max_rows:
+        return None, None, (jsonify({'success': False, 'message': f'单次最多处理{max_rows}个手机号'}), 400)
+    return rows, invalid, None
+
+@app.route('/batch_verify_password', methods=['POST'])
+@nacos_env()
+def batch_verify_password():
+    """批量验证密码: 每块手机号一次 phone = ANY 查询, 逐个返回 ok/mismatch/not_found"""
+    rows, invalid, error = load_password_batch('password')
+    if error:
+        return error
+    chunk_size = int((config.get('batch') or {}).get('chunk_size', 1000))
+
+    try:
+        expected = hash_passwords(rows)
+        phones = list(rows)
+        stored = {}
+        with read_connection(g.env, phones=phones) as conn:
+            with conn.cursor() as cursor:
+                with timed_query('batch_get_password'):
+                    for i in range(0, len(phones), chunk_size):
+                        cursor.execute(queries.BATCH_GET_PASSWORD, (phones[i:i + chunk_size],))
+                        stored.update((phone, password) for phone, password in cursor.fetchall())
+    except Exception as e:
+        logger.error("批量验证密码失败: %s", e)
         return jsonify({'success': False, 'message': str(e)})
 
+    results = []
+    summary = {'ok': 0, 'mismatch': 0, 'not_found': 0}
+    for phone in phones:
+        if phone not in stored:
+            status = 'not_found'
+        else:
+            status = 'ok' if stored[phone] == expected[phone] else 'mismatch'
+        summary[status] += 1
+        results.append({'phone': phone, 'status': status})
+    return jsonify({
+        'success': True,
+        'data': {
+            'results': results,
+            'summary': dict(summary, requested=len(phones)),
+            'invalid': invalid
+        }
+    })
+
+@app.route('/batch_update_password', methods=['POST'])
+@nacos_env()
+def batch_update_password():
+    """批量重置密码: 每块一条 UPDATE ... FROM (VALUES ...), 全部在一个事务中提交"""
+    rows, invalid, error = load_password_batch('new_password')
+    if error:
+        return error
+    chunk_size = int((config.get('batch') or {}).get('chunk_size', 1000))
+
+    try:
+        values = list(hash_passwords(rows).items())
+        updated = set()
+        with g.env.db.connection() as conn:
+            with conn.cursor() as cursor:
+                with timed_query('batch_update_password'):
+                    for i in range(0, len(values), chunk_size):
+                        returned = execute_values(
+                            cursor,
+                            queries.BATCH_UPDATE_PASSWORD,
+                            values[i:i + chunk_size],
+                            page_size=chunk_size,
+                            fetch=True
+                        )
+                        updated.update(row[0] for row in returned)
+            conn.commit()
+            record_write(g.env, conn, updated)
+    except Exception as e:
+        logger.error("批量修改密码失败: %s", e)
+        return jsonify({'success': False, 'message': str(e)})
+
+    results = [{'phone': phone, 'status': 'updated' if phone in updated else 'not_found'} for phone in rows]
+    logger.info("批量修改密码完成: %s, 更新%s个, 未找到%s个, 无效%s行",
+                g.env.client_key, len(updated), len(rows) - len(updated), len(invalid))
+    return jsonify({
+        'success': True,
+        'message': '批量修改完成',
+        'data': {
+            'results': results,
+            'summary': {'requested': len(rows), 'updated': len(updated), 'not_found': len(rows) - len(updated)},
+            'invalid': invalid
+        }
+    })
+
 import argparse
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--port', type=int, default=8001, help='Port to run the server on')
     args = parser.parse_args()
-    app.run(host='0.0.0.0', port=args.port, debug=True)
\ No newline at end of file
+    # 仅用于本地开发, 生产环境使用 gunicorn -c gunicorn.conf.py
+    debug = os.getenv('FLASK_DEBUG', '0').lower() in ('1', 'true')
+    # debug模式下由reloader启动的子进程负责预热
+    if not debug or os.getenv('WERKZEUG_RUN_MAIN') == 'true':
+        start_warmup()
+    app.run(host='0.0.0.0', port=args.port, debug=debug)
\ No newline at end of file
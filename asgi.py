@@ -0,0 +1,545 @@
+"""异步服务模式(ASGI)
+
+余额、密码、健康检查和网关接口在事件循环中处理: Nacos配置通过 httpx 异步拉取,
+数据库访问使用 psycopg 异步连接池, 某个环境的数据库变慢时不会占住其他请求的线程.
+首页、Nacos环境管理等其余接口挂载原Flask应用继续提供.
+
+启动: uvicorn asgi:app --host 0.0.0.0 --port 8001 --workers 4
+"""
+import asyncio
+import functools
+import logging
+import time
+from contextlib import asynccontextmanager
+
+import httpx
+import psycopg
+from a2wsgi import WSGIMiddleware
+from psycopg.conninfo import make_conninfo
+from psycopg_pool import AsyncConnectionPool
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route
+
+import app as flask_module
+import queries
+from circuit_breaker import CircuitOpenError
+from app import app as flask_app, config, parse_nacos_config, calculate_md5, calculate_password_md5, start_warmup
+from app import DB_READ_ROUTES, replica_router, replica_targets, load_saved_envs
+from app import REQUEST_SECONDS, DB_QUERY_SECONDS, NACOS_FETCH_SECONDS
+
+logger = logging.getLogger(__name__)
+
+NACOS_CONFIG_FILE = 'common.yml'
+NACOS_CONFIG_GROUP = 'v1.0.0'
+
+
+class EnvError(Exception):
+    """环境解析失败, 携带返回给前端的信息和状态码"""
+
+    def __init__(self, message, status=500, details=None):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.details = details
+
+
+class AsyncEnvironments:
+    """异步模式下按 {server_address}_{namespace} 管理的Nacos配置缓存与数据库连接池"""
+
+    def __init__(self):
+        self.http = None
+        # client_key: (config, fetched_at)
+        self._configs = {}
+        # client_key: 正在进行的首次拉取, 并发请求共享结果
+        self._inflight = {}
+        self._refreshing = set()
+        # 持有后台刷新任务的引用, 避免任务被回收
+        self._tasks = set()
+        # client_key: (db_config, AsyncConnectionPool)
+        self._pools = {}
+        self._pool_lock = None
+
+    async def start(self):
+        self.http = httpx.AsyncClient(timeout=httpx.Timeout(5.0, connect=3.0))
+        self._pool_lock = asyncio.Lock()
+
+    async def close(self):
+        for _, pool in list(self._pools.values()):
+            await pool.close()
+        self._pools.clear()
+        if self.http:
+            await self.http.aclose()
+
+    async def _fetch_config(self, server_address, namespace, username, password):
+        """通过Nacos Open API拉取common.yml并解析"""
+        last_error = None
+        for address in server_address.split(','):
+            address = address.strip()
+            base = address if address.startswith('http') else f'http://{address}'
+            params = {'dataId': NACOS_CONFIG_FILE, 'group': NACOS_CONFIG_GROUP, 'tenant': namespace}
+            try:
+                if username and password:
+                    resp = await self.http.post(f'{base}/nacos/v1/auth/login',
+                                                data={'username': username, 'password': password})
+                    # 未开启鉴权的Nacos直接匿名访问
+                    if resp.status_code == 200:
+                        params['accessToken'] = resp.json().get('accessToken')
+                resp = await self.http.get(f'{base}/nacos/v1/cs/configs', params=params)
+                if resp.status_code == 404 or not resp.text:
+                    return None
+                resp.raise_for_status()
+                return parse_nacos_config(resp.text)
+            except httpx.HTTPError as e:
+                logger.warning("从Nacos获取配置失败: %s, %s", address, e)
+                last_error = e
+        raise EnvError(f'Nacos配置获取失败: {str(last_error)}', 500,
+                       '请检查Nacos服务器地址、命名空间及凭据是否正确')
+
+    async def _fetch_guarded(self, client_key, *args):
+        """经Nacos熔断器(与Flask部分共用)拉取配置, 连接失败和配置为空都计入失败"""
+        # reset_after_fork 会替换熔断器注册表, 每次从模块上读取
+        breaker = flask_module.circuit_breakers.get(f'nacos:{client_key}')
+        breaker.allow()
+        try:
+            with NACOS_FETCH_SECONDS.time(env=client_key):
+                result = await self._fetch_config(*args)
+        except Exception as e:
+            breaker.record_failure(e)
+            raise
+        if result is None:
+            breaker.record_failure(f'Nacos中{NACOS_CONFIG_FILE}不存在或内容为空')
+        else:
+            breaker.record_success()
+        return result
+
+    async def _refresh(self, client_key, *args):
+        try:
+            result = await self._fetch_guarded(client_key, *args)
+            if result is not None:
+                self._configs[client_key] = (result, time.monotonic())
+        except Exception as e:
+            logger.warning("后台刷新Nacos配置失败, 继续使用旧配置: %s, %s", client_key, e)
+        finally:
+            self._refreshing.discard(client_key)
+
+    async def get_config(self, client_key, server_address, namespace, username, password):
+        args = (server_address, namespace, username, password)
+        ttl = float((config.get('nacos_cache') or {}).get('ttl', 300))
+        cached = self._configs.get(client_key)
+        if cached:
+            result, fetched_at = cached
+            if ttl > 0 and time.monotonic() - fetched_at > ttl and client_key not in self._refreshing:
+                self._refreshing.add(client_key)
+                task = asyncio.create_task(self._refresh(client_key, *args))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            return result
+
+        future = self._inflight.get(client_key)
+        if future is None:
+            future = asyncio.ensure_future(self._fetch_guarded(client_key, *args))
+            self._inflight[client_key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(client_key, None))
+        result = await asyncio.shield(future)
+        if result is not None:
+            self._configs[client_key] = (result, time.monotonic())
+        return result
+
+    async def get_pool(self, client_key, db_config):
+        entry = self._pools.get(client_key)
+        if entry and entry[0] == db_config:
+            return entry[1]
+        async with self._pool_lock:
+            entry = self._pools.get(client_key)
+            if entry and entry[0] == db_config:
+                return entry[1]
+            pool_config = config.get('db_pool') or {}
+            pool = AsyncConnectionPool(
+                make_conninfo(connect_timeout=3, **db_config),
+                min_size=int(pool_config.get('min_size', 1)),
+                max_size=int(pool_config.get('max_size', 10)),
+                max_idle=float(pool_config.get('idle_timeout', 300)),
+                timeout=float(pool_config.get('acquire_timeout', 5)),
+                check=AsyncConnectionPool.check_connection if pool_config.get('health_check', True) else None,
+                name=client_key,
+                open=False,
+            )
+            await pool.open()
+            self._pools[client_key] = (dict(db_config), pool)
+        if entry:
+            await entry[1].close()
+        return pool
+
+    async def resolve(self, request, require_db=True):
+        """解析URL中的Nacos参数, 返回 (server_address, namespace, client_key, nacos_config)"""
+        return await self.resolve_env(
+            request.query_params.get('server_address'),
+            request.query_params.get('namespace'),
+            request.query_params.get('username', 'nacos'),
+            request.query_params.get('password', 'nacos'),
+            require_db=require_db
+        )
+
+    async def resolve_env(self, server_address, namespace, username='nacos', password='nacos', require_db=True):
+        server_address = (server_address or '').strip()
+        if not server_address or not namespace:
+            raise EnvError('缺少必要参数: server_address和namespace', 400)
+        if ':' not in server_address:
+            server_address = f'{server_address}:8848'
+        client_key = f'{server_address}_{namespace}'
+
+        try:
+            nacos_config = await self.get_config(client_key, server_address, namespace, username, password)
+        except CircuitOpenError as e:
+            raise EnvError(f'Nacos环境不可用: {e}', 503)
+        if not nacos_config:
+            raise EnvError('未找到Nacos配置', 404, f'配置路径: {NACOS_CONFIG_FILE}, 命名空间: {namespace}')
+        if require_db and 'db_config' not in nacos_config:
+            raise EnvError('配置中缺少数据库配置', 404, '请检查common.yml是否包含正确的PostgreSQL配置')
+        return server_address, namespace, client_key, nacos_config
+
+
+envs = AsyncEnvironments()
+
+
+async def _release(pool, conn):
+    """结束只读查询开启的隐式事务后归还连接, 避免连接池归还时告警回滚"""
+    try:
+        if not conn.closed:
+            await conn.rollback()
+    except psycopg.Error as e:
+        logger.warning("回滚从库连接失败: %s", e)
+    await pool.putconn(conn)
+
+
+@asynccontextmanager
+async def read_connection(client_key, nacos_config, phone=None, cookies=None):
+    """只读请求使用的连接, 路由规则与Flask部分的 read_connection 相同"""
+    min_lsn = replica_router.written_lsn(client_key, cookies or {})
+    replicas = dict(replica_targets(client_key, nacos_config))
+    acquired = None
+    reason = 'no_replica'
+    for _ in range(len(replicas)):
+        replica_key, reason = replica_router.choose(client_key, list(replicas), phone)
+        if replica_key is None:
+            break
+        try:
+            pool = await envs.get_pool(replica_key, replicas[replica_key])
+            conn = await pool.getconn()
+        except Exception as e:
+            logger.warning("从库不可用, 暂停使用: %s, %s", replica_key, e)
+            replica_router.mark_failed(replica_key, e)
+            reason = 'unavailable'
+            continue
+        if replica_router.needs_lag_check(replica_key):
+            try:
+                cursor = await conn.execute(queries.REPLICATION_LAG)
+                lag = (await cursor.fetchone())[0]
+                await conn.rollback()
+            except Exception as e:
+                logger.warning("检查从库复制延迟失败: %s, %s", replica_key, e)
+                await _release(pool, conn)
+                replica_router.mark_failed(replica_key, e)
+                reason = 'unavailable'
+                continue
+            if not replica_router.record_lag(replica_key, lag):
+                logger.warning("从库复制延迟过大, 暂停使用: %s, %s秒", replica_key, lag)
+                await pool.putconn(conn)
+                reason = 'lagging'
+                continue
+        if min_lsn is not None:
+            try:
+                cursor = await conn.execute(queries.REPLAYED_LSN, (min_lsn,))
+                replayed = (await cursor.fetchone())[0]
+            except Exception as e:
+                logger.warning("检查从库回放位置失败: %s, %s", replica_key, e)
+                await _release(pool, conn)
+                replica_router.mark_failed(replica_key, e)
+                reason = 'unavailable'
+                continue
+            if not replayed:
+                await _release(pool, conn)
+                reason = 'behind_write'
+                continue
+        acquired = (replica_key, pool, conn)
+        break
+
+    if acquired is None:
+        if replicas:
+            DB_READ_ROUTES.inc(env=client_key, target='primary', reason=reason)
+        pool = await envs.get_pool(client_key, nacos_config['db_config'])
+        async with pool.connection() as conn:
+            yield conn
+        return
+
+    DB_READ_ROUTES.inc(env=client_key, target='replica', reason='ok')
+    replica_key, pool, conn = acquired
+    try:
+        yield conn
+    except psycopg.OperationalError as e:
+        replica_router.mark_failed(replica_key, e)
+        raise
+    finally:
+        await _release(pool, conn)
+
+
+async def record_write(conn, client_key, nacos_config, phone):
+    """写入已提交: 本进程内该手机号短时间读主库, 返回写入响应需要设置的cookie参数(不需要时为None)"""
+    replica_router.pin(client_key, phone)
+    if not nacos_config.get('replica_configs'):
+        return None
+    try:
+        cursor = await conn.execute(queries.CURRENT_WAL_LSN)
+        lsn = (await cursor.fetchone())[0]
+    except psycopg.Error as e:
+        logger.warning("读取主库WAL位置失败: %s, %s", client_key, e)
+        return None
+    return replica_router.written_lsn_cookie_args(client_key, lsn)
+
+
+def written_response(body, cookie):
+    response = JSONResponse(body)
+    if cookie:
+        response.set_cookie(**cookie)
+    return response
+
+
+def timed(handler):
+    """记录接口耗时, 与Flask部分共用 balance_http_request_duration_seconds 指标"""
+    @functools.wraps(handler)
+    async def wrapper(request):
+        started = time.perf_counter()
+        response = await handler(request)
+        REQUEST_SECONDS.observe(time.perf_counter() - started, route=request.url.path,
+                                method=request.method, status=response.status_code)
+        return response
+    return wrapper
+
+
+def env_error_response(e):
+    body = {'success': False, 'message': e.message}
+    if e.details:
+        body['details'] = e.details
+    return JSONResponse(body, status_code=e.status)
+
+
+async def get_gateway_url(request):
+    try:
+        server_address, namespace, _, nacos_config = await envs.resolve(request, require_db=False)
+        if 'gateway_url' not in nacos_config:
+            return JSONResponse({'success': False, 'message': '配置中缺少网关URL'}, status_code=404)
+        return JSONResponse({
+            'success': True,
+            'gateway_url': nacos_config['gateway_url'],
+            'message': '网关配置获取成功',
+            'server_info': f'{server_address} (namespace: {namespace})'
+        })
+    except EnvError as e:
+        return env_error_response(e)
+    except Exception as e:
+        logger.error("获取网关URL失败: %s", e, exc_info=True)
+        return JSONResponse({'success': False, 'message': f'服务器内部错误: {str(e)}'}, status_code=500)
+
+
+async def get_balance(request):
+    phone = request.query_params.get('phone')
+    if not phone:
+        return JSONResponse({'success': False, 'message': '手机号不能为空'})
+    try:
+        server_address, _, client_key, nacos_config = await envs.resolve(request)
+        async with read_connection(client_key, nacos_config, phone, request.cookies) as conn:
+            with DB_QUERY_SECONDS.time(env=client_key, query='get_balance'):
+                cursor = await conn.execute(queries.GET_BALANCE, (phone,))
+                result = await cursor.fetchone()
+        if not result:
+            return JSONResponse({'success': False, 'message': '未找到用户余额信息'})
+        return JSONResponse({
+            'success': True,
+            'data': {
+                'balance': float(result[0]),
+                'encrypt': result[1],
+                'environment': f'Nacos({server_address})'
+            }
+        })
+    except EnvError as e:
+        return env_error_response(e)
+    except Exception as e:
+        logger.error("查询余额失败: %s", e)
+        return JSONResponse({'success': False, 'message': str(e)})
+
+
+async def update_balance(request):
+    try:
+        form = await request.form()
+        phone = form['phone']
+        new_balance = float(form['balance'])
+        balance_encrypt = calculate_md5(new_balance)
+
+        server_address, namespace, client_key, nacos_config = await envs.resolve(request)
+        pool = await envs.get_pool(client_key, nacos_config['db_config'])
+        async with pool.connection() as conn:
+            with DB_QUERY_SECONDS.time(env=client_key, query='update_balance'):
+                cursor = await conn.execute(queries.UPDATE_BALANCE, (new_balance, balance_encrypt, phone))
+                updated = await cursor.fetchone()
+            if not updated:
+                await conn.rollback()
+                return JSONResponse({'success': False, 'message': '用户不存在'})
+            await conn.commit()
+            cookie = await record_write(conn, client_key, nacos_config, phone)
+        # 写穿Flask部分(/batch_get_balance 等)使用的余额读缓存
+        cache = flask_module.get_balance_cache(client_key)
+        if cache is not None:
+            cache.set(phone, (float(updated[0]), updated[1]))
+        return written_response({
+            'success': True,
+            'message': '余额更新成功',
+            'data': {
+                'balance': float(updated[0]),
+                'encrypt': updated[1],
+                'server_info': f'{server_address} (namespace: {namespace})'
+            }
+        }, cookie)
+    except EnvError as e:
+        return env_error_response(e)
+    except Exception as e:
+        logger.error("更新余额失败: %s", e)
+        return JSONResponse({'success': False, 'message': str(e)})
+
+
+async def health_check(request):
+    try:
+        server_address, namespace, client_key, nacos_config = await envs.resolve(request)
+        async with read_connection(client_key, nacos_config, cookies=request.cookies) as conn:
+            await conn.execute('SELECT 1')
+        return JSONResponse({
+            'status': 'ok',
+            'breakers': flask_module.circuit_breakers.snapshot(),
+            'replicas': replica_router.snapshot([key for key, _ in replica_targets(client_key, nacos_config)]),
+            'message': '服务运行正常',
+            'server_info': f'{server_address} (namespace: {namespace})'
+        })
+    except EnvError as e:
+        return JSONResponse({'status': 'error', 'breakers': flask_module.circuit_breakers.snapshot(),
+                             'message': e.message}, status_code=e.status)
+    except Exception as e:
+        logger.error("健康检查失败: %s", e)
+        return JSONResponse({'status': 'error', 'breakers': flask_module.circuit_breakers.snapshot(),
+                             'message': str(e)}, status_code=500)
+
+
+async def verify_password(request):
+    try:
+        form = await request.form()
+        phone = form['phone']
+        password_md5 = calculate_password_md5(form['password'])
+
+        _, _, client_key, nacos_config = await envs.resolve(request)
+        async with read_connection(client_key, nacos_config, phone, request.cookies) as conn:
+            with DB_QUERY_SECONDS.time(env=client_key, query='get_password'):
+                cursor = await conn.execute(queries.GET_PASSWORD, (phone,))
+                result = await cursor.fetchone()
+        if not result:
+            return JSONResponse({'success': False, 'message': '未找到用户信息'})
+        if password_md5 == result[0]:
+            return JSONResponse({'success': True, 'message': '密码验证通过'})
+        return JSONResponse({'success': False, 'message': '密码不正确'})
+    except EnvError as e:
+        return env_error_response(e)
+    except Exception as e:
+        logger.error("验证密码失败: %s", e)
+        return JSONResponse({'success': False, 'message': str(e)})
+
+
+async def update_password(request):
+    try:
+        form = await request.form()
+        phone = form['phone']
+        new_password_md5 = calculate_password_md5(form['new_password'])
+
+        _, _, client_key, nacos_config = await envs.resolve(request)
+        pool = await envs.get_pool(client_key, nacos_config['db_config'])
+        async with pool.connection() as conn:
+            with DB_QUERY_SECONDS.time(env=client_key, query='update_password'):
+                cursor = await conn.execute(queries.UPDATE_PASSWORD, (new_password_md5, phone))
+            if cursor.rowcount == 0:
+                await conn.rollback()
+                return JSONResponse({'success': False, 'message': '用户不存在'})
+            await conn.commit()
+            cookie = await record_write(conn, client_key, nacos_config, phone)
+        return written_response({'success': True, 'message': '密码修改成功'}, cookie)
+    except EnvError as e:
+        return env_error_response(e)
+    except Exception as e:
+        logger.error("修改密码失败: %s", e)
+        return JSONResponse({'success': False, 'message': str(e)})
+
+
+async def warm_up_envs():
+    """并行预热已保存环境的异步配置缓存和连接池
+
+    在 lifespan 启动阶段等待完成(最多 warmup.timeout 秒), 期间worker不接收请求, /readyz 也就不会提前返回就绪
+    """
+    settings = config.get('warmup') or {}
+    if not settings.get('enabled', True):
+        return
+    try:
+        saved = load_saved_envs()
+    except Exception as e:
+        logger.error("读取已保存的Nacos环境失败, 跳过异步预热: %s", e)
+        return
+    semaphore = asyncio.Semaphore(int(settings.get('max_workers', 8)))
+
+    async def warm_up(item):
+        async with semaphore:
+            try:
+                _, _, client_key, nacos_config = await envs.resolve_env(
+                    item.get('server_addresses'), item.get('namespace'),
+                    item.get('username', 'nacos'), item.get('password', 'nacos'),
+                    require_db=False
+                )
+                if 'db_config' in nacos_config:
+                    pool = await envs.get_pool(client_key, nacos_config['db_config'])
+                    await pool.wait()
+                return True
+            except Exception as e:
+                logger.warning("异步预热环境失败, 首次请求时重试: %s_%s, %s",
+                               item.get('server_addresses'), item.get('namespace'), e)
+                return False
+
+    started = time.perf_counter()
+    try:
+        results = await asyncio.wait_for(asyncio.gather(*(warm_up(item) for item in saved)),
+                                         float(settings.get('timeout', 60)))
+    except asyncio.TimeoutError:
+        logger.warning("异步预热超时, 剩余环境在首次请求时初始化")
+        return
+    logger.info("异步预热完成: %s/%s个环境, 耗时%.2fs", sum(results), len(saved), time.perf_counter() - started)
+
+
+@asynccontextmanager
+async def lifespan(_app):
+    await envs.start()
+    # 直接用 uvicorn 启动时没有 post_fork, 在这里预热Flask部分的环境
+    start_warmup()
+    # 余额、密码等接口使用异步连接池, 需要单独预热
+    await warm_up_envs()
+    try:
+        yield
+    finally:
+        await envs.close()
+
+
+app = Starlette(
+    routes=[
+        Route('/get_gateway_url', timed(get_gateway_url)),
+        Route('/get_balance', timed(get_balance)),
+        Route('/update_balance', timed(update_balance), methods=['POST']),
+        Route('/health', timed(health_check)),
+        Route('/verify_password', timed(verify_password), methods=['POST']),
+        Route('/update_password', timed(update_password), methods=['POST']),
+        # 其余页面和接口由Flask应用处理
+        Mount('/', app=WSGIMiddleware(flask_app)),
+    ],
+    lifespan=lifespan,
+)
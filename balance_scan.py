@@ -0,0 +1,182 @@
+"""余额MD5完整性扫描
+
+服务端游标分批读取 pay_member_asset_account 的余额和 account_balance_encrypt, 分发到进程池
+用 calculate_md5 重新计算并比对, 不一致的会员写入CSV; --repair 时按批在独立事务中修复.
+
+    python balance_scan.py --server-address 10.0.1.79 --namespace server
+    python balance_scan.py --dsn "host=127.0.0.1 dbname=test user=postgres" --workers 8 --repair
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2.extras import execute_values
+from tqdm import tqdm
+
+import queries
+from app import EnvResolveError, calculate_md5, get_db_connection_with_config, resolve_env
+
+logger = logging.getLogger(__name__)
+
+CSV_HEADER = ('member_id', 'phone', 'balance', 'stored_encrypt', 'expected_encrypt')
+
+
+def check_batch(rows):
+    """在子进程中比对一批余额, 返回 (行数, 不一致的行); 余额为NULL时 expected 为None"""
+    mismatches = []
+    for member_id, phone, balance, stored in rows:
+        expected = calculate_md5(balance) if balance is not None else None
+        if expected is None or expected != stored:
+            mismatches.append((member_id, phone, balance, stored, expected))
+    return len(rows), mismatches
+
+
+def repair(conn, rows):
+    """在一个事务中修复一批行, 返回实际更新的行数"""
+    with conn.cursor() as cursor:
+        execute_values(cursor, queries.REPAIR_BALANCE_ENCRYPT, rows, page_size=len(rows))
+        updated = cursor.rowcount
+    conn.commit()
+    return updated
+
+
+class Scanner:
+    def __init__(self, connect, workers, batch_size, repair=False, repair_batch_size=1000):
+        self.connect = connect
+        self.workers = workers
+        self.batch_size = batch_size
+        self.repair = repair
+        self.repair_batch_size = repair_batch_size
+        self.stats = {'scanned': 0, 'mismatched': 0, 'repaired': 0, 'repair_skipped': 0}
+        self._repair_conn = None
+        self._pending_repairs = []
+
+    def _estimate_rows(self, conn):
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(queries.ESTIMATE_ASSET_ROWS)
+                row = cursor.fetchone()
+            conn.rollback()
+            return int(row[0]) if row and row[0] > 0 else None
+        except psycopg2.Error:
+            conn.rollback()
+            return None
+
+    def _flush_repairs(self, force=False):
+        if not self._pending_repairs or (len(self._pending_repairs) < self.repair_batch_size and not force):
+            return
+        batch, self._pending_repairs = self._pending_repairs, []
+        if self._repair_conn is None:
+            self._repair_conn = self.connect()
+        updated = repair(self._repair_conn, batch)
+        self.stats['repaired'] += updated
+        # 扫描之后余额被修改过的行不覆盖
+        self.stats['repair_skipped'] += len(batch) - updated
+
+    def _handle(self, result, writer, progress):
+        count, mismatches = result
+        self.stats['scanned'] += count
+        self.stats['mismatched'] += len(mismatches)
+        for row in mismatches:
+            writer.writerow(row)
+            member_id, _, balance, _, expected = row
+            if self.repair and expected is not None:
+                self._pending_repairs.append((member_id, balance, expected))
+        self._flush_repairs()
+        progress.update(count)
+        progress.set_postfix(mismatched=self.stats['mismatched'], repaired=self.stats['repaired'], refresh=False)
+
+    def run(self, writer):
+        started = time.perf_counter()
+        conn = self.connect()
+        try:
+            total = self._estimate_rows(conn)
+            conn.set_session(readonly=True)
+            progress = tqdm(total=total, unit='行', unit_scale=True, desc='扫描余额', file=sys.stderr)
+            # 最多 workers*2 个批次在途, 内存占用与表大小无关
+            max_pending = self.workers * 2
+            pending = set()
+            with ProcessPoolExecutor(max_workers=self.workers) as pool, \
+                    conn.cursor(name='balance_integrity_scan', cursor_factory=psycopg2.extensions.cursor) as cursor:
+                cursor.itersize = self.batch_size
+                cursor.execute(queries.SCAN_BALANCE_INTEGRITY)
+                while True:
+                    rows = cursor.fetchmany(self.batch_size)
+                    if rows:
+                        pending.add(pool.submit(check_batch, rows))
+                    if pending and (len(pending) >= max_pending or not rows):
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED if rows else ALL_COMPLETED)
+                        for future in done:
+                            self._handle(future.result(), writer, progress)
+                    if not rows:
+                        break
+            self._flush_repairs(force=True)
+            progress.close()
+        finally:
+            conn.close()
+            if self._repair_conn is not None:
+                self._repair_conn.close()
+
+        elapsed = time.perf_counter() - started
+        return dict(
+            self.stats,
+            seconds=round(elapsed, 2),
+            rows_per_second=round(self.stats['scanned'] / elapsed, 1) if elapsed else 0
+        )
+
+
+def build_connect(args):
+    """返回新建数据库连接的函数, 数据库配置来自 --dsn 或 Nacos"""
+    if args.dsn:
+        return lambda: psycopg2.connect(args.dsn)
+    env = resolve_env(args.server_address, args.namespace, username=args.username, password=args.password)
+    db_config = {'db_config': dict(env.config['db_config'])}
+    return lambda: get_db_connection_with_config(db_config)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='检查 account_balance_encrypt 与余额MD5是否一致')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--dsn', help='直接指定数据库连接串')
+    source.add_argument('--server-address', help='Nacos地址, 从 common.yml 读取数据库配置')
+    parser.add_argument('--namespace', default='server')
+    parser.add_argument('--username', default='nacos')
+    parser.add_argument('--password', default='nacos')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='计算MD5的进程数')
+    parser.add_argument('--batch-size', type=int, default=20000, help='每批读取并分发的行数')
+    parser.add_argument('--repair', action='store_true', help='修复不一致的行')
+    parser.add_argument('--repair-batch-size', type=int, default=1000, help='每个修复事务的行数')
+    parser.add_argument('--output', help='不一致行的CSV路径, 默认 balance-mismatches-<时间>.csv')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    try:
+        connect = build_connect(args)
+    except EnvResolveError as e:
+        logger.error("解析Nacos环境失败: %s", e.message)
+        return 2
+
+    output = args.output or f"balance-mismatches-{time.strftime('%Y%m%d%H%M%S')}.csv"
+    scanner = Scanner(connect, max(1, args.workers), max(1, args.batch_size),
+                      repair=args.repair, repair_batch_size=max(1, args.repair_batch_size))
+    with open(output, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_HEADER)
+        summary = scanner.run(writer)
+    summary['output'] = output
+    logger.info("余额完整性扫描完成: %s", summary)
+    print(json.dumps(summary, ensure_ascii=False))
+    return 1 if summary['mismatched'] > summary['repaired'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,171 @@
+"""基准测试用的Nacos替身
+
+只实现应用用到的配置接口:
+- GET  /nacos/v1/cs/configs           读取配置(dataId/group/tenant)
+- POST /nacos/v1/auth/login           登录, 返回固定accessToken
+- POST /nacos/v1/cs/configs/listener  长轮询监听, md5不一致时立即返回变更的key
+
+单独启动: python bench/fake_nacos.py --port 8848 --config common.yml
+"""
+import argparse
+import hashlib
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlsplit
+
+WORD_SEPARATOR = '\x02'
+LINE_SEPARATOR = '\x01'
+
+# 长轮询最长挂起时间, 避免基准结束时等待过久
+MAX_PULLING_SECONDS = 30
+
+
+def render_common_yml(db_config, gateway_url):
+    """按应用 parse_nacos_config 读取的字段生成common.yml"""
+    return (
+        'pgsql:\n'
+        f"  address: {db_config['host']}\n"
+        f"  port: {db_config['port']}\n"
+        f"  username: {db_config['user']}\n"
+        f"  password: '{db_config.get('password', '')}'\n"
+        f"  dbname: {db_config['dbname']}\n"
+        'gateway:\n'
+        f'  url: {gateway_url}\n'
+    )
+
+
+class FakeNacos:
+    """线程模式的HTTP服务, 所有命名空间和分组共用同一份配置内容"""
+
+    def __init__(self, content, host='127.0.0.1', port=0):
+        self._content = content
+        self._changed = threading.Condition()
+        self.requests = Counter()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def address(self):
+        host, port = self._server.server_address[:2]
+        return f'{host}:{port}'
+
+    @property
+    def content(self):
+        return self._content
+
+    @property
+    def md5(self):
+        return hashlib.md5(self._content.encode()).hexdigest() if self._content else ''
+
+    def set_content(self, content):
+        """替换配置内容并唤醒所有长轮询"""
+        with self._changed:
+            self._content = content
+            self._changed.notify_all()
+
+    def wait_for_change(self, md5, timeout):
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            while self.md5 == md5:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._changed.wait(remaining)
+        return True
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-nacos', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        # 唤醒仍在挂起的长轮询
+        self.set_content(self._content)
+
+    def _handler_class(self):
+        nacos = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, body, content_type='text/plain; charset=utf-8'):
+                data = body.encode()
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _form(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length).decode() if length else ''
+                return {k: v[-1] for k, v in parse_qs(body, keep_blank_values=True).items()}
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                nacos.requests[url.path] += 1
+                if url.path == '/nacos/v1/cs/configs':
+                    content = nacos.content
+                    if not content:
+                        return self._send(404, 'config data not exist')
+                    return self._send(200, content)
+                self._send(404, 'not found')
+
+            def do_POST(self):
+                url = urlsplit(self.path)
+                nacos.requests[url.path] += 1
+                form = self._form()
+                if url.path == '/nacos/v1/auth/login':
+                    return self._send(200, json.dumps({'accessToken': 'bench-token', 'tokenTtl': 18000}),
+                                      'application/json')
+                if url.path == '/nacos/v1/cs/configs/listener':
+                    return self._listen(form)
+                self._send(404, 'not found')
+
+            def _listen(self, form):
+                probes = [
+                    line.split(WORD_SEPARATOR)
+                    for line in form.get('Listening-Configs', '').split(LINE_SEPARATOR) if line
+                ]
+                timeout = int(self.headers.get('Long-Pulling-Timeout') or 30000) / 1000
+                current = nacos.md5
+                stale = [p for p in probes if len(p) >= 3 and p[2] != current]
+                if not stale and probes:
+                    nacos.wait_for_change(current, min(timeout, MAX_PULLING_SECONDS))
+                    stale = probes if nacos.md5 != current else []
+                changed = ''.join(
+                    WORD_SEPARATOR.join(p[:2] + p[3:4]) + LINE_SEPARATOR for p in stale
+                )
+                self._send(200, quote(changed))
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Nacos配置接口替身')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8848)
+    parser.add_argument('--config', required=True, help='作为common.yml返回的文件')
+    args = parser.parse_args()
+
+    with open(args.config, encoding='utf-8') as f:
+        nacos = FakeNacos(f.read(), args.host, args.port).start()
+    print(f'fake nacos listening on {nacos.address}')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        nacos.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""基准测试用的本地PostgreSQL
+
+- 未指定DSN时用 initdb/pg_ctl 在临时目录创建一个只监听127.0.0.1的实例, 结束后删除
+- seed() 按规模重建 mem_member / mem_user / pay_member_asset_account 并填充数据
+"""
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+
+import psycopg2
+
+BENCH_PASSWORD = 'bench123'
+MD5_SALT = 'lingxi'
+
+SCHEMA = """
+DROP TABLE IF EXISTS pay_member_asset_account, mem_user, mem_member;
+
+CREATE TABLE mem_member (
+    id bigint PRIMARY KEY,
+    phone varchar(20) NOT NULL UNIQUE
+);
+
+CREATE TABLE mem_user (
+    id bigint PRIMARY KEY,
+    phone varchar(20) NOT NULL UNIQUE,
+    password varchar(64) NOT NULL
+);
+
+CREATE TABLE pay_member_asset_account (
+    id bigint PRIMARY KEY,
+    member_id bigint NOT NULL UNIQUE REFERENCES mem_member (id),
+    account_balance numeric(18, 2) NOT NULL,
+    account_balance_encrypt varchar(64) NOT NULL
+);
+"""
+
+# 余额取 x.5, float8::text 与 Python str(float) 格式一致, md5 与 calculate_md5 相同
+SEED = """
+INSERT INTO mem_member (id, phone)
+SELECT g, %(prefix)s || lpad(g::text, 9, '0') FROM generate_series(1, %(members)s) g;
+
+INSERT INTO mem_user (id, phone, password)
+SELECT g, %(prefix)s || lpad(g::text, 9, '0'), md5(%(salt)s || %(password)s)
+FROM generate_series(1, %(members)s) g;
+
+INSERT INTO pay_member_asset_account (id, member_id, account_balance, account_balance_encrypt)
+SELECT g, g, (g %% 100000) + 0.5, md5(((g %% 100000) + 0.5)::float8::text)
+FROM generate_series(1, %(members)s) g;
+"""
+
+PHONE_PREFIX = '13'
+
+
+def bench_phone(index):
+    """第 index 个(从1开始)种子会员的手机号"""
+    return f'{PHONE_PREFIX}{index:09d}'
+
+
+def _find_binary(name):
+    path = shutil.which(name)
+    if path:
+        return path
+    pg_config = shutil.which('pg_config')
+    if pg_config:
+        bindir = subprocess.run([pg_config, '--bindir'], capture_output=True, text=True).stdout.strip()
+        candidate = os.path.join(bindir, name)
+        if os.path.exists(candidate):
+            return candidate
+    raise RuntimeError(f'未找到 {name}, 请安装PostgreSQL或通过 --pg-dsn 指定已有数据库')
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class LocalPostgres:
+    """临时PostgreSQL实例, db_config 的字段与Nacos中pgsql配置解析结果一致"""
+
+    def __init__(self, port=None, max_connections=300):
+        self.port = port or _free_port()
+        self.max_connections = max_connections
+        self.data_dir = None
+        self.db_config = {
+            'host': '127.0.0.1',
+            'port': self.port,
+            'user': 'postgres',
+            'password': '',
+            'dbname': 'postgres',
+        }
+
+    def start(self):
+        self.data_dir = tempfile.mkdtemp(prefix='balance-bench-pg-')
+        subprocess.run(
+            [_find_binary('initdb'), '-D', self.data_dir, '-U', 'postgres', '--auth=trust', '-E', 'UTF8'],
+            check=True, capture_output=True
+        )
+        options = ' '.join([
+            f'-p {self.port}',
+            '-c listen_addresses=127.0.0.1',
+            f'-c unix_socket_directories={self.data_dir}',
+            f'-c max_connections={self.max_connections}',
+            # 只用于压测, 关闭持久化相关的等待
+            '-c fsync=off',
+            '-c synchronous_commit=off',
+            '-c full_page_writes=off',
+        ])
+        subprocess.run(
+            [_find_binary('pg_ctl'), '-D', self.data_dir, '-o', options,
+             '-l', os.path.join(self.data_dir, 'postgres.log'), '-w', 'start'],
+            check=True, capture_output=True
+        )
+        return self
+
+    def stop(self):
+        if not self.data_dir:
+            return
+        subprocess.run([_find_binary('pg_ctl'), '-D', self.data_dir, '-m', 'fast', '-w', 'stop'],
+                       capture_output=True)
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+        self.data_dir = None
+
+
+def db_config_from_dsn(dsn):
+    """把 --pg-dsn 转成应用使用的 db_config"""
+    params = psycopg2.extensions.parse_dsn(dsn)
+    return {
+        'host': params.get('host', '127.0.0.1'),
+        'port': int(params.get('port', 5432)),
+        'user': params.get('user', 'postgres'),
+        'password': params.get('password', ''),
+        'dbname': params.get('dbname', 'postgres'),
+    }
+
+
+def wait_until_ready(db_config, timeout=30):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            psycopg2.connect(connect_timeout=3, **db_config).close()
+            return
+        except psycopg2.OperationalError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+
+
+def seed(db_config, members):
+    """重建业务表并写入 members 个会员, 每个会员一条用户记录和一条资产账户"""
+    conn = psycopg2.connect(**db_config)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(SCHEMA)
+            cursor.execute(SEED, {
+                'members': members,
+                'prefix': PHONE_PREFIX,
+                'salt': MD5_SALT,
+                'password': BENCH_PASSWORD,
+            })
+        conn.commit()
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute('ANALYZE mem_member, mem_user, pay_member_asset_account')
+    finally:
+        conn.close()
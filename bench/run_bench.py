@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""接口基准测试
+
+启动本地PostgreSQL(或使用 --pg-dsn 指定的库)和Nacos替身, 按规模填充数据后用gunicorn启动应用,
+以固定并发依次压测各接口, 记录 p50/p95/p99 延迟和吞吐量并写入JSON, 可与历史结果对比.
+
+    python bench/run_bench.py --members 100000 --concurrency 32 --duration 20
+    python bench/run_bench.py --pg-dsn "host=127.0.0.1 user=postgres dbname=bench" --routes get_balance,update_balance
+    python bench/run_bench.py --compare bench/results/baseline.json --max-regression 10
+"""
+import argparse
+import http.client
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlencode
+
+from fake_nacos import FakeNacos, render_common_yml
+from local_pg import BENCH_PASSWORD, LocalPostgres, bench_phone, db_config_from_dsn, seed, wait_until_ready
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+NAMESPACE = 'bench'
+BATCH_SIZE = 100
+
+
+def _form(data):
+    return urlencode(data), {'Content-Type': 'application/x-www-form-urlencoded'}
+
+
+def _json(data):
+    return json.dumps(data), {'Content-Type': 'application/json'}
+
+
+def random_balance(rng):
+    return rng.randint(0, 99999) + 0.5
+
+
+# 接口名: 生成 (method, 路径, 是否带Nacos参数, body生成函数)
+ROUTES = {
+    'index': ('GET', '/', False, None),
+    'get_nacos_configs': ('GET', '/get_nacos_configs', False, None),
+    'get_gateway_url': ('GET', '/get_gateway_url', True, None),
+    'health': ('GET', '/health', True, None),
+    'get_balance': ('GET', '/get_balance', True, None),
+    'update_balance': ('POST', '/update_balance', True,
+                       lambda rng, phone, n: _form({'phone': phone, 'balance': random_balance(rng)})),
+    'batch_get_balance': ('POST', '/batch_get_balance', True,
+                          lambda rng, phone, n: _json([bench_phone(rng.randint(1, n)) for _ in range(BATCH_SIZE)])),
+    'batch_update_balance': ('POST', '/batch_update_balance', True,
+                             lambda rng, phone, n: _json([
+                                 {'phone': bench_phone(rng.randint(1, n)), 'balance': random_balance(rng)}
+                                 for _ in range(BATCH_SIZE)
+                             ])),
+    'verify_password': ('POST', '/verify_password', True,
+                        lambda rng, phone, n: _form({'phone': phone, 'password': BENCH_PASSWORD})),
+    # 改回相同的密码, 不影响后续的验证
+    'update_password': ('POST', '/update_password', True,
+                        lambda rng, phone, n: _form({'phone': phone, 'new_password': BENCH_PASSWORD})),
+    'metrics': ('GET', '/metrics', False, None),
+}
+
+
+def percentile(sorted_values, pct):
+    """最近秩法百分位"""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def is_failure(status, content_type, body):
+    if status >= 400:
+        return True
+    if content_type.startswith('application/json'):
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return True
+        return isinstance(data, dict) and (data.get('success') is False or data.get('status') == 'error')
+    if content_type.startswith('application/x-ndjson'):
+        last = body.rstrip(b'\n').rsplit(b'\n', 1)[-1]
+        return b'"success": true' not in last
+    return False
+
+
+class Driver:
+    """固定并发压测单个接口, 每个线程持有一条keep-alive连接"""
+
+    def __init__(self, host, port, nacos_query, members, concurrency, seed_value=0):
+        self.host = host
+        self.port = port
+        self.nacos_query = nacos_query
+        self.members = members
+        self.concurrency = concurrency
+        self.seed_value = seed_value
+
+    def _request(self, conn, rng, route):
+        method, path, with_env, make_body = ROUTES[route]
+        phone = bench_phone(rng.randint(1, self.members))
+        params = dict(self.nacos_query) if with_env else {}
+        if route == 'get_balance':
+            params['phone'] = phone
+        url = f'{path}?{urlencode(params)}' if params else path
+        body, headers = make_body(rng, phone, self.members) if make_body else (None, {})
+        conn.request(method, url, body=body, headers=headers)
+        resp = conn.getresponse()
+        data = resp.read()
+        return resp.status, resp.getheader('Content-Type') or '', data
+
+    def run(self, route, duration, warmup):
+        latencies = []
+        errors = []
+        lock = threading.Lock()
+        start_barrier = threading.Barrier(self.concurrency + 1)
+        deadline = [0.0]
+
+        def worker(index):
+            rng = random.Random(self.seed_value * 1000 + index)
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            local_latencies = []
+            local_errors = 0
+            for _ in range(warmup):
+                try:
+                    self._request(conn, rng, route)
+                except (OSError, http.client.HTTPException):
+                    conn.close()
+            start_barrier.wait()
+            while time.perf_counter() < deadline[0]:
+                started = time.perf_counter()
+                try:
+                    status, content_type, body = self._request(conn, rng, route)
+                    failed = is_failure(status, content_type, body)
+                except (OSError, http.client.HTTPException):
+                    conn.close()
+                    failed = True
+                local_latencies.append(time.perf_counter() - started)
+                local_errors += failed
+            conn.close()
+            with lock:
+                latencies.extend(local_latencies)
+                errors.append(local_errors)
+
+        threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(self.concurrency)]
+        for t in threads:
+            t.start()
+        # 所有线程预热完成后同时开始计时
+        deadline[0] = time.perf_counter() + 3600
+        start_barrier.wait()
+        started = time.perf_counter()
+        deadline[0] = started + duration
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        ms = [v * 1000 for v in latencies]
+        return {
+            'requests': len(ms),
+            'errors': sum(errors),
+            'elapsed_seconds': round(elapsed, 3),
+            'throughput_rps': round(len(ms) / elapsed, 1) if elapsed else 0,
+            'latency_ms': {
+                'p50': _round(percentile(ms, 50)),
+                'p95': _round(percentile(ms, 95)),
+                'p99': _round(percentile(ms, 99)),
+                'mean': _round(sum(ms) / len(ms) if ms else None),
+                'max': _round(ms[-1] if ms else None),
+            },
+        }
+
+
+def _round(value):
+    return round(value, 3) if value is not None else None
+
+
+def start_app(port, args, log_file):
+    env = dict(os.environ)
+    env.update({
+        'PORT': str(port),
+        'SERVER_MODE': args.server,
+        'WEB_CONCURRENCY': str(args.workers),
+        'GUNICORN_THREADS': str(args.threads),
+        # 压测期间不回收worker, 避免重建连接池影响结果
+        'GUNICORN_MAX_REQUESTS': '0',
+        'GUNICORN_LOG_LEVEL': 'warning',
+        'LOG_LEVEL': args.log_level,
+    })
+    return subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py'],
+        cwd=ROOT, env=env, stdout=log_file, stderr=subprocess.STDOUT
+    )
+
+
+def wait_for_http(host, port, process=None, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f'应用进程已退出, 退出码 {process.returncode}')
+        try:
+            conn = http.client.HTTPConnection(host, port, timeout=2)
+            conn.request('GET', '/')
+            conn.getresponse().read()
+            conn.close()
+            return
+        except (OSError, http.client.HTTPException):
+            time.sleep(0.3)
+    raise RuntimeError(f'等待 {host}:{port} 启动超时')
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(result, baseline_path, max_regression):
+    """打印与基线的差异, 返回超过阈值的接口列表"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions = []
+    print(f"\n对比基线 {baseline_path} ({baseline.get('meta', {}).get('git_revision')})")
+    print(f"{'route':<22}{'p95 ms':>12}{'Δp95':>9}{'rps':>11}{'Δrps':>9}")
+    for route, current in result['routes'].items():
+        base = baseline.get('routes', {}).get(route)
+        if not base:
+            continue
+        p95, base_p95 = current['latency_ms']['p95'], base['latency_ms']['p95']
+        rps, base_rps = current['throughput_rps'], base['throughput_rps']
+        d_p95 = (p95 - base_p95) / base_p95 * 100 if p95 is not None and base_p95 else 0.0
+        d_rps = (rps - base_rps) / base_rps * 100 if base_rps else 0.0
+        print(f'{route:<22}{p95:>12.2f}{d_p95:>+8.1f}%{rps:>11.1f}{d_rps:>+8.1f}%')
+        if max_regression is not None and (d_p95 > max_regression or -d_rps > max_regression):
+            regressions.append(route)
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='余额服务接口基准测试')
+    parser.add_argument('--members', type=int, default=10000, help='填充的会员数量')
+    parser.add_argument('--concurrency', type=int, default=16, help='并发连接数')
+    parser.add_argument('--duration', type=float, default=10, help='每个接口的压测秒数')
+    parser.add_argument('--warmup', type=int, default=5, help='每个连接计时前的预热请求数')
+    parser.add_argument('--routes', default=','.join(ROUTES), help='逗号分隔的接口名')
+    parser.add_argument('--server', choices=('wsgi', 'asgi'), default='wsgi', help='gunicorn的SERVER_MODE')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--port', type=int, default=18001, help='应用监听端口')
+    parser.add_argument('--pg-dsn', default=os.getenv('BENCH_PG_DSN'), help='使用已有数据库, 不启动临时实例')
+    parser.add_argument('--skip-seed', action='store_true', help='数据库已填充时跳过重建')
+    parser.add_argument('--log-level', default='WARNING', help='应用日志级别')
+    parser.add_argument('--seed', type=int, default=0, help='随机数种子')
+    parser.add_argument('--output', help='结果JSON路径, 默认 bench/results/<时间>.json')
+    parser.add_argument('--compare', help='作为基线的结果JSON')
+    parser.add_argument('--max-regression', type=float, help='p95上升或吞吐下降超过该百分比时退出码为1')
+    args = parser.parse_args()
+    unknown = [r for r in args.routes.split(',') if r not in ROUTES]
+    if unknown:
+        parser.error(f"未知接口: {', '.join(unknown)}, 可选: {', '.join(ROUTES)}")
+    return args
+
+
+def main():
+    args = parse_args()
+    routes = args.routes.split(',')
+    postgres = None
+    nacos = None
+    app_process = None
+    log_file = tempfile.NamedTemporaryFile(prefix='balance-bench-app-', suffix='.log', delete=False)
+
+    try:
+        if args.pg_dsn:
+            db_config = db_config_from_dsn(args.pg_dsn)
+        else:
+            print('启动临时PostgreSQL...')
+            postgres = LocalPostgres().start()
+            db_config = postgres.db_config
+        wait_until_ready(db_config)
+        if not args.skip_seed:
+            print(f'填充数据: {args.members} 个会员...')
+            started = time.perf_counter()
+            seed(db_config, args.members)
+            print(f'填充完成, 耗时 {time.perf_counter() - started:.1f}s')
+
+        nacos = FakeNacos(render_common_yml(db_config, 'http://127.0.0.1:9999/gateway')).start()
+        print(f'Nacos替身: {nacos.address}')
+
+        app_process = start_app(args.port, args, log_file)
+        wait_for_http('127.0.0.1', args.port, app_process)
+        print(f'应用已启动 ({args.server}, {args.workers} workers x {args.threads} threads), 日志: {log_file.name}')
+
+        nacos_query = {'server_address': nacos.address, 'namespace': NAMESPACE}
+        driver = Driver('127.0.0.1', args.port, nacos_query, args.members, args.concurrency, args.seed)
+        results = {}
+        for route in routes:
+            stats = driver.run(route, args.duration, args.warmup)
+            results[route] = stats
+            latency = stats['latency_ms']
+            print(f"{route:<22} {stats['throughput_rps']:>9.1f} rps  p50 {latency['p50']:>8.2f}ms  "
+                  f"p95 {latency['p95']:>8.2f}ms  p99 {latency['p99']:>8.2f}ms  errors {stats['errors']}")
+    finally:
+        if app_process is not None:
+            app_process.terminate()
+            try:
+                app_process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                app_process.kill()
+        if nacos is not None:
+            nacos.stop()
+        if postgres is not None:
+            postgres.stop()
+        log_file.close()
+
+    result = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'git_revision': git_revision(),
+            'server_mode': args.server,
+            'workers': args.workers,
+            'threads': args.threads,
+            'concurrency': args.concurrency,
+            'duration_seconds': args.duration,
+            'members': args.members,
+            'batch_size': BATCH_SIZE,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'nacos_requests': dict(nacos.requests) if nacos else {},
+        },
+        'routes': results,
+    }
+    output = args.output or os.path.join(
+        ROOT, 'bench', 'results', datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f'结果已写入 {output}')
+
+    if args.compare:
+        regressions = compare(result, args.compare, args.max_regression)
+        if regressions:
+            print(f"性能回退超过 {args.max_regression}%: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+import threading
+import time
+
+
+class CircuitOpenError(Exception):
+    """熔断器打开或失败缓存未过期时快速失败"""
+
+
+class CircuitBreaker:
+    """单个环境依赖(Nacos/数据库)的熔断器
+
+    - closed: 正常放行; 失败后 failure_cache_ttl 秒内直接返回上次的错误(失败缓存),
+      连续失败达到 failure_threshold 次后打开
+    - open: 直接抛出 CircuitOpenError, reset_timeout 秒后进入 half_open
+    - half_open: 只放行一个探测请求, 成功则关闭, 失败则重新打开
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold=3, reset_timeout=30, failure_cache_ttl=3):
+        self.name = name
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_timeout = float(reset_timeout)
+        self.failure_cache_ttl = float(failure_cache_ttl)
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._last_failure_at = 0.0
+        self._last_error = None
+        self._probing = False
+        self._rejected = 0
+
+    def allow(self):
+        """检查是否放行本次调用, 不放行时抛出 CircuitOpenError"""
+        with self._lock:
+            now = time.monotonic()
+            if self._state == self.OPEN and now - self._opened_at >= self.reset_timeout:
+                self._state = self.HALF_OPEN
+                self._probing = False
+
+            if self._state == self.HALF_OPEN:
+                if not self._probing:
+                    self._probing = True
+                    return
+                reason = '熔断探测中'
+            elif self._state == self.OPEN:
+                reason = f'熔断中, {self.reset_timeout - (now - self._opened_at):.0f}秒后重试'
+            elif self._last_error and now - self._last_failure_at < self.failure_cache_ttl:
+                reason = '最近失败'
+            else:
+                return
+            self._rejected += 1
+            raise CircuitOpenError(f"{self.name} {reason}: {self._last_error}")
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+            self._last_error = None
+
+    def record_failure(self, error):
+        with self._lock:
+            now = time.monotonic()
+            self._failures += 1
+            self._last_failure_at = now
+            self._last_error = str(error)
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = now
+            self._probing = False
+
+    def call(self, fn, *args, **kwargs):
+        self.allow()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            self.record_failure(e)
+            raise
+        self.record_success()
+        return result
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def snapshot(self):
+        state = self.state
+        with self._lock:
+            return {
+                'state': state,
+                'failures': self._failures,
+                'rejected': self._rejected,
+                'last_error': self._last_error,
+            }
+
+
+class BreakerRegistry:
+    """按名称懒创建熔断器, 名称形如 nacos:{client_key} / db:{client_key}"""
+
+    def __init__(self, **settings):
+        self._settings = settings
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def configure(self, **settings):
+        self._settings = settings
+
+    def get(self, name):
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.get(name)
+                if breaker is None:
+                    breaker = self._breakers[name] = CircuitBreaker(name, **self._settings)
+        return breaker
+
+    def snapshot(self):
+        return {name: breaker.snapshot() for name, breaker in list(self._breakers.items())}
@@ -0,0 +1,230 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+
+logger = logging.getLogger(__name__)
+
+
+class PoolExhaustedError(Exception):
+    """连接池在等待超时内没有可用连接"""
+
+
+class DBPool:
+    """单个环境的PostgreSQL连接池
+
+    - min_size: 池中至少保留的空闲连接数(空闲回收不会低于此值)
+    - max_size: 同时存在的最大连接数, 超出时借用方等待 acquire_timeout 秒
+    - idle_timeout: 空闲超过该秒数的连接在借用/归还时回收, 另有后台线程每 idle_timeout/2 秒回收一次,
+      突发流量后不再有请求时多出的连接也会被关闭
+    - health_check: 借出前对空闲超过 health_check_interval 秒的连接执行 SELECT 1
+    """
+
+    def __init__(self, name, connect, min_size=1, max_size=10, idle_timeout=300,
+                 health_check=True, health_check_interval=30, acquire_timeout=5):
+        self.name = name
+        self._connect = connect
+        self.min_size = max(0, int(min_size))
+        self.max_size = max(1, int(max_size), self.min_size)
+        self.idle_timeout = float(idle_timeout)
+        self.health_check = bool(health_check)
+        self.health_check_interval = float(health_check_interval)
+        self.acquire_timeout = float(acquire_timeout)
+
+        self._cond = threading.Condition()
+        # 空闲连接栈: [(conn, last_used)], 栈顶为最近归还的连接
+        self._idle = []
+        self._in_use = 0
+        self._closed = False
+        self._stop = threading.Event()
+        self._stats = {
+            'created': 0,
+            'destroyed': 0,
+            'borrowed': 0,
+            'returned': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'health_check_failures': 0,
+            'evicted_idle': 0,
+        }
+
+        try:
+            for _ in range(self.min_size):
+                self._idle.append((self._new_connection(), time.monotonic()))
+        except Exception:
+            self.close()
+            raise
+
+        if self.idle_timeout > 0:
+            threading.Thread(target=self._reap_loop, name=f'db-pool-reaper-{name}', daemon=True).start()
+
+    def _incr(self, key, n=1):
+        with self._cond:
+            self._stats[key] += n
+
+    def _new_connection(self):
+        conn = self._connect()
+        self._incr('created')
+        return conn
+
+    def _discard(self, conn):
+        self._incr('destroyed')
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _evict_idle(self, now):
+        """回收空闲过久的连接, 需持有锁调用, 返回待关闭的连接"""
+        if self.idle_timeout <= 0:
+            return []
+        evicted = []
+        keep = []
+        # 栈底是最久未使用的连接, 从底部开始回收
+        removable = len(self._idle) - self.min_size
+        for conn, last_used in self._idle:
+            if removable > 0 and now - last_used > self.idle_timeout:
+                evicted.append(conn)
+                removable -= 1
+            else:
+                keep.append((conn, last_used))
+        self._idle = keep
+        self._stats['evicted_idle'] += len(evicted)
+        return evicted
+
+    def _reap_loop(self):
+        interval = max(1.0, self.idle_timeout / 2)
+        while not self._stop.wait(interval):
+            self.reap()
+
+    def reap(self):
+        """回收空闲过久的连接, 由后台线程定期调用"""
+        with self._cond:
+            if self._closed:
+                return
+            to_close = self._evict_idle(time.monotonic())
+        for conn in to_close:
+            self._discard(conn)
+        if to_close:
+            logger.debug("连接池[%s]回收空闲连接: %s个", self.name, len(to_close))
+
+    def _is_healthy(self, conn, last_used, now):
+        if conn.closed:
+            return False
+        if not self.health_check or now - last_used < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except Exception as e:
+            logger.warning("连接池[%s]连接健康检查失败: %s", self.name, e)
+            return False
+
+    def getconn(self, timeout=None):
+        """借出一个连接, 池满时最多等待 acquire_timeout(或更短的 timeout)秒, 超时抛出 PoolExhaustedError"""
+        wait = self.acquire_timeout if timeout is None else min(timeout, self.acquire_timeout)
+        deadline = time.monotonic() + wait
+        while True:
+            with self._cond:
+                if self._closed:
+                    raise PoolExhaustedError(f"连接池已关闭: {self.name}")
+                now = time.monotonic()
+                evicted = self._evict_idle(now)
+                candidate = None
+                if self._idle:
+                    candidate = self._idle.pop()
+                    self._in_use += 1
+                elif self._in_use + len(self._idle) < self.max_size:
+                    self._in_use += 1
+                else:
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise PoolExhaustedError(
+                            f"数据库连接池已耗尽: {self.name} (max_size={self.max_size})")
+                    self._stats['waits'] += 1
+                    self._cond.wait(remaining)
+                    continue
+
+            for conn in evicted:
+                self._discard(conn)
+
+            try:
+                if candidate is not None:
+                    conn, last_used = candidate
+                    if not self._is_healthy(conn, last_used, time.monotonic()):
+                        self._incr('health_check_failures')
+                        self._discard(conn)
+                        conn = self._new_connection()
+                else:
+                    conn = self._new_connection()
+            except Exception:
+                with self._cond:
+                    self._in_use -= 1
+                    self._cond.notify()
+                raise
+
+            self._incr('borrowed')
+            return conn
+
+    def putconn(self, conn, discard=False):
+        """归还连接, 出错或事务未结束的连接会被回滚或丢弃"""
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                discard = True
+        discard = discard or conn.closed
+
+        with self._cond:
+            self._in_use -= 1
+            self._stats['returned'] += 1
+            if discard or self._closed:
+                to_close = [conn]
+            else:
+                self._idle.append((conn, time.monotonic()))
+                to_close = []
+            to_close.extend(self._evict_idle(time.monotonic()))
+            self._cond.notify()
+
+        for c in to_close:
+            self._discard(c)
+
+    @contextmanager
+    def connection(self, timeout=None):
+        conn = self.getconn(timeout)
+        broken = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            self.putconn(conn, discard=broken)
+
+    def close(self):
+        self._stop.set()
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'name': self.name,
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'closed': self._closed,
+                **self._stats,
+            }
@@ -126,7 +126,7 @@ check_service_health() {
     
     print_message "$YELLOW" "检查服务健康状态..."
     while [ $retries -gt 0 ]; do
-        if ssh $HOST "curl -s http://localhost:$PORT/health" | grep -q "ok"; then
+        if ssh $HOST "curl -sf http://localhost:$PORT/readyz" | grep -q "ok"; then
             print_message "$GREEN" "✓ 服务健康检查通过"
             return 0
         fi
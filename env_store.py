@@ -0,0 +1,125 @@
+"""已保存的Nacos环境(nacos-data/nacos_configs.json)
+
+- 内存中按 server_addresses 建立索引, 文件 mtime/大小未变化时不重新读取和解析
+- 写入时先写同目录临时文件再 os.replace, 读取方不会看到写了一半的文件
+- 多个worker进程通过 fcntl 文件锁串行写入, 加锁后重新加载磁盘内容再合并, 不会互相覆盖
+"""
+import json
+import logging
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows 本地开发时只保证单进程内安全
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class EnvStoreError(Exception):
+    """环境文件无法解析"""
+
+
+class EnvStore:
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = path + '.lock'
+        self._lock = threading.RLock()
+        self._items = []
+        # server_addresses -> 在 _items 中的下标
+        self._index = {}
+        self._signature = None
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    def _load(self):
+        """调用方持有 _lock; 文件未变化时直接返回"""
+        signature = self._stat()
+        if signature == self._signature:
+            return
+        if signature is None:
+            items = []
+        else:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    items = json.load(f)
+            except json.JSONDecodeError as e:
+                raise EnvStoreError(f'{os.path.basename(self.path)}文件格式错误: {e}') from e
+            if not isinstance(items, list):
+                raise EnvStoreError(f'{os.path.basename(self.path)}内容必须是数组')
+        self._items = items
+        self._index = {
+            item['server_addresses']: i
+            for i, item in enumerate(items) if isinstance(item, dict) and 'server_addresses' in item
+        }
+        self._signature = signature
+        logger.debug("已加载保存的Nacos环境: %s个", len(items))
+
+    @contextmanager
+    def _file_lock(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        if fcntl is None:
+            yield
+            return
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write(self, items):
+        directory = os.path.dirname(self.path) or '.'
+        fd, tmp_path = tempfile.mkstemp(prefix='.nacos_configs.', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(items, f, ensure_ascii=False, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def list(self):
+        """返回全部保存的环境"""
+        with self._lock:
+            self._load()
+            return list(self._items)
+
+    def get(self, server_addresses):
+        with self._lock:
+            self._load()
+            i = self._index.get(server_addresses)
+            return self._items[i] if i is not None else None
+
+    def save(self, env_config):
+        """新增或按 server_addresses 覆盖, 返回是否为新增"""
+        key = env_config['server_addresses']
+        with self._lock, self._file_lock():
+            # 其他进程可能刚写过, 加锁后以磁盘内容为准
+            self._load()
+            items = list(self._items)
+            i = self._index.get(key)
+            created = i is None
+            if created:
+                items.append(env_config)
+            else:
+                items[i] = env_config
+            self._write(items)
+            self._items = items
+            if created:
+                self._index[key] = len(items) - 1
+            self._signature = self._stat()
+        return created
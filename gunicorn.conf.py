@@ -0,0 +1,43 @@
+"""Gunicorn生产环境配置
+
+    gunicorn -c gunicorn.conf.py                      # WSGI: app:app, gthread多线程worker
+    SERVER_MODE=asgi gunicorn -c gunicorn.conf.py     # ASGI: asgi:app, uvicorn worker
+
+- preload_app: master进程预先导入应用(含load_config), fork出的worker共享只读内存
+- post_fork: 每个worker重置Nacos客户端和数据库连接池, 连接在worker内按需新建, 不共享socket;
+  随后后台并行预热 nacos_configs.json 中的环境, 完成前 /readyz 返回503
+- 平滑重启: kill -HUP <master pid> 逐个替换worker; 代码更新需 kill -USR2 后再 kill -QUIT 旧master
+"""
+import multiprocessing
+import os
+
+server_mode = os.getenv('SERVER_MODE', 'wsgi')
+
+wsgi_app = 'asgi:app' if server_mode == 'asgi' else 'app:app'
+worker_class = 'uvicorn.workers.UvicornWorker' if server_mode == 'asgi' else 'gthread'
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8001')}"
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+
+preload_app = True
+
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '60'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = 5
+
+# 处理指定请求数后回收worker(防止内存膨胀), 默认关闭:
+# 回收会丢弃worker中的连接池、Nacos客户端和各级缓存并重新预热, 需要时通过环境变量开启
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '0'))
+max_requests_jitter = max_requests // 10
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+
+def post_fork(server, worker):
+    """worker启动后丢弃从master继承的客户端和连接池, 并在后台预热已保存的环境"""
+    import app
+    app.reset_after_fork()
+    app.start_warmup()
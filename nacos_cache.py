@@ -0,0 +1,172 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class _CacheEntry:
+    __slots__ = ('value', 'loaded_at', 'loader', 'on_evict', 'refreshing')
+
+    def __init__(self, value, loader=None, on_evict=None):
+        self.value = value
+        self.loaded_at = time.monotonic()
+        self.loader = loader
+        self.on_evict = on_evict
+        self.refreshing = False
+
+
+class NacosConfigCache:
+    """Nacos配置缓存
+
+    - 按LRU淘汰, 最多保留 max_entries 个环境
+    - 超过 ttl 秒的配置仍然立即返回, 同时在后台线程中调用 loader 刷新,
+      刷新失败时继续使用上一次成功获取的配置
+    - 配置变更监听通过 update() 直接替换缓存内容
+    - 条目被淘汰或失效时调用 on_evict(用于注销Nacos监听器)
+    """
+
+    def __init__(self, max_entries=32, ttl=300):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = float(ttl)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+        self.evictions = 0
+
+    def configure(self, max_entries=None, ttl=None):
+        with self._lock:
+            if max_entries is not None:
+                self.max_entries = max(1, int(max_entries))
+            if ttl is not None:
+                self.ttl = float(ttl)
+            evicted = self._evict_overflow()
+        self._run_on_evict(evicted)
+
+    def peek(self, key):
+        """读取缓存但不计入命中统计、不触发刷新"""
+        entry = self._entries.get(key)
+        return entry.value if entry is not None else None
+
+    def get(self, key):
+        """返回缓存的配置, 未命中返回None; 过期时触发后台刷新"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            stale = (
+                self.ttl > 0
+                and entry.loader is not None
+                and not entry.refreshing
+                and time.monotonic() - entry.loaded_at > self.ttl
+            )
+            if stale:
+                entry.refreshing = True
+
+        if stale:
+            threading.Thread(
+                target=self._refresh, args=(key, entry),
+                name=f"nacos-refresh-{key}", daemon=True
+            ).start()
+        return entry.value
+
+    def _refresh(self, key, entry):
+        try:
+            value = entry.loader()
+        except Exception as e:
+            logger.warning("后台刷新Nacos配置失败: %s, %s", key, e)
+            value = None
+
+        with self._lock:
+            entry.refreshing = False
+            # 无论成功与否都重置时间, 失败时等下一个TTL周期再重试
+            entry.loaded_at = time.monotonic()
+            self.refreshes += 1
+            if value is None:
+                self.refresh_failures += 1
+            elif self._entries.get(key) is entry:
+                entry.value = value
+
+    def set(self, key, value, loader=None, on_evict=None):
+        """写入配置, loader 用于过期后的后台刷新"""
+        replaced = None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._entries[key] = _CacheEntry(value, loader, on_evict)
+            else:
+                entry.value = value
+                entry.loaded_at = time.monotonic()
+                if loader is not None:
+                    entry.loader = loader
+                if on_evict is not None and on_evict is not entry.on_evict:
+                    replaced, entry.on_evict = entry.on_evict, on_evict
+                self._entries.move_to_end(key)
+            evicted = self._evict_overflow()
+        if replaced:
+            evicted.append((key, replaced))
+        self._run_on_evict(evicted)
+
+    def update(self, key, value):
+        """仅在key已缓存时替换内容(配置变更通知使用), 返回是否更新"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False
+            entry.value = value
+            entry.loaded_at = time.monotonic()
+            return True
+
+    def invalidate(self, key):
+        """移除单个环境的缓存, 返回是否存在"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        self._run_on_evict([(key, entry.on_evict)])
+        return True
+
+    def _evict_overflow(self):
+        evicted = []
+        while len(self._entries) > self.max_entries:
+            key, entry = self._entries.popitem(last=False)
+            self.evictions += 1
+            evicted.append((key, entry.on_evict))
+        return evicted
+
+    def _run_on_evict(self, evicted):
+        for key, on_evict in evicted:
+            if on_evict is None:
+                continue
+            try:
+                on_evict()
+            except Exception as e:
+                logger.warning("注销Nacos配置监听失败: %s, %s", key, e)
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'refreshes': self.refreshes,
+                'refresh_failures': self.refresh_failures,
+                'evictions': self.evictions,
+                'entries': {
+                    key: {
+                        'age': round(now - entry.loaded_at, 1),
+                        'refreshing': entry.refreshing,
+                    }
+                    for key, entry in self._entries.items()
+                },
+            }
@@ -0,0 +1,94 @@
+"""按连接缓存的服务端预处理语句
+
+固定SQL在每条连接上首次执行时 PREPARE, 之后只发送 EXECUTE, 省去服务端重复的解析和计划.
+预处理语句属于会话, 不随事务回滚, 连接关闭后失效; 连接池中的每条连接各自记录已准备的语句.
+"""
+import re
+import threading
+
+import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+
+STATEMENT_PREFIX = 'bm_'
+
+_PLACEHOLDER = re.compile(r'%s|%%')
+
+
+class PreparingConnection(psycopg2.extensions.connection):
+    """记录本连接上已 PREPARE 的语句名, 通过 psycopg2.connect(connection_factory=...) 使用"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared_statements = set()
+
+
+class _Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # 语句名: [hits, misses]
+        self._counts = {}
+        self.invalidated = 0
+
+    def record(self, name, hit):
+        with self._lock:
+            counts = self._counts.setdefault(name, [0, 0])
+            counts[0 if hit else 1] += 1
+
+    def invalidate(self):
+        with self._lock:
+            self.invalidated += 1
+
+    def snapshot(self):
+        with self._lock:
+            statements = {name: {'hits': h, 'misses': m} for name, (h, m) in self._counts.items()}
+            invalidated = self.invalidated
+        hits = sum(s['hits'] for s in statements.values())
+        misses = sum(s['misses'] for s in statements.values())
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / (hits + misses), 4) if hits + misses else None,
+            'invalidated': invalidated,
+            'statements': statements,
+        }
+
+
+_stats = _Stats()
+
+
+def to_positional(sql):
+    """把 %s 占位符转换为 PREPARE 使用的 $1, $2 ..."""
+    counter = iter(range(1, sql.count('%s') + 1))
+    return _PLACEHOLDER.sub(lambda m: '%' if m.group() == '%%' else f'${next(counter)}', sql)
+
+
+def execute_prepared(cursor, name, sql, params=()):
+    """在 cursor 所属连接上执行预处理语句, 连接不支持时退化为普通 execute"""
+    prepared = getattr(cursor.connection, 'prepared_statements', None)
+    if prepared is None:
+        cursor.execute(sql, params)
+        return
+
+    statement = STATEMENT_PREFIX + name
+    hit = statement in prepared
+    if not hit:
+        cursor.execute(f'PREPARE {statement} AS {to_positional(sql)}')
+        prepared.add(statement)
+    _stats.record(name, hit)
+
+    try:
+        if params:
+            cursor.execute(f"EXECUTE {statement} ({', '.join(['%s'] * len(params))})", params)
+        else:
+            cursor.execute(f'EXECUTE {statement}')
+    except psycopg2.errors.InvalidSqlStatementName:
+        # 服务端已不存在(如被 DISCARD ALL), 下次重新 PREPARE
+        prepared.discard(statement)
+        _stats.invalidate()
+        raise
+
+
+def stats():
+    """本进程预处理语句的命中/未命中次数"""
+    return _stats.snapshot()
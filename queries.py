@@ -0,0 +1,133 @@
+"""业务SQL语句, 同步(psycopg2)和异步(psycopg)服务共用, 参数占位符均为 %s"""
+
+# 按手机号查询余额
+GET_BALANCE = """
+SELECT account_balance, account_balance_encrypt
+FROM pay_member_asset_account
+WHERE member_id = (SELECT id FROM mem_member WHERE phone = %s)
+"""
+
+# 按手机号查询余额并返回会员ID(用于填充 phone -> member_id 缓存)
+GET_BALANCE_WITH_MEMBER = """
+SELECT m.id, a.account_balance, a.account_balance_encrypt
+FROM mem_member m
+JOIN pay_member_asset_account a ON a.member_id = m.id
+WHERE m.phone = %s
+"""
+
+# 已知会员ID时只查资产表
+GET_BALANCE_BY_MEMBER = """
+SELECT account_balance, account_balance_encrypt
+FROM pay_member_asset_account
+WHERE member_id = %s
+"""
+
+# 按手机号关联会员并更新余额, 参数: (balance, balance_encrypt, phone)
+UPDATE_BALANCE = """
+UPDATE pay_member_asset_account a
+SET account_balance = %s, account_balance_encrypt = %s
+FROM mem_member m
+WHERE a.member_id = m.id AND m.phone = %s
+RETURNING a.account_balance, a.account_balance_encrypt, a.member_id
+"""
+
+# 已知会员ID时只更新资产表, 参数: (balance, balance_encrypt, member_id)
+UPDATE_BALANCE_BY_MEMBER = """
+UPDATE pay_member_asset_account
+SET account_balance = %s, account_balance_encrypt = %s
+WHERE member_id = %s
+RETURNING account_balance, account_balance_encrypt
+"""
+
+# 批量查询余额, 参数: (phones,)
+BATCH_GET_BALANCE = """
+SELECT m.phone, a.account_balance, a.account_balance_encrypt, m.id
+FROM mem_member m
+JOIN pay_member_asset_account a ON a.member_id = m.id
+WHERE m.phone = ANY(%s)
+"""
+
+# 导出环境内所有会员余额(服务端游标分批读取)
+EXPORT_BALANCE = """
+SELECT m.phone, a.account_balance, a.account_balance_encrypt
+FROM pay_member_asset_account a
+JOIN mem_member m ON m.id = a.member_id
+ORDER BY a.member_id
+"""
+
+# 余额MD5完整性扫描: float8 与 Python float 的 str() 一致, 用于重新计算 calculate_md5
+SCAN_BALANCE_INTEGRITY = """
+SELECT a.member_id, m.phone, a.account_balance::float8, a.account_balance_encrypt
+FROM pay_member_asset_account a
+LEFT JOIN mem_member m ON m.id = a.member_id
+"""
+
+# 资产表行数估计(用于显示进度)
+ESTIMATE_ASSET_ROWS = "SELECT reltuples::bigint FROM pg_class WHERE relname = 'pay_member_asset_account'"
+
+# 修复余额MD5, 余额在扫描后被修改过的行不处理, 参数: [(member_id, balance, balance_encrypt)]
+REPAIR_BALANCE_ENCRYPT = """
+UPDATE pay_member_asset_account a
+SET account_balance_encrypt = v.balance_encrypt
+FROM (VALUES %s) AS v(member_id, balance, balance_encrypt)
+WHERE a.member_id = v.member_id AND a.account_balance::float8 = v.balance::float8
+"""
+
+# 批量更新余额: 临时表 + UPDATE ... FROM
+CREATE_TMP_BALANCE_UPDATE = """
+CREATE TEMP TABLE tmp_balance_update (
+    phone varchar PRIMARY KEY,
+    balance numeric,
+    balance_encrypt varchar
+) ON COMMIT DROP
+"""
+
+INSERT_TMP_BALANCE_UPDATE = "INSERT INTO tmp_balance_update (phone, balance, balance_encrypt) VALUES %s"
+
+APPLY_TMP_BALANCE_UPDATE = """
+UPDATE pay_member_asset_account a
+SET account_balance = t.balance, account_balance_encrypt = t.balance_encrypt
+FROM tmp_balance_update t
+JOIN mem_member m ON m.phone = t.phone
+WHERE a.member_id = m.id
+RETURNING m.phone, m.id
+"""
+
+# 查询用户密码
+GET_PASSWORD = "SELECT password FROM mem_user WHERE phone = %s"
+
+# 更新用户密码, 参数: (password_md5, phone)
+UPDATE_PASSWORD = "UPDATE mem_user SET password = %s WHERE phone = %s"
+
+# 批量查询用户密码, 参数: (phones,)
+BATCH_GET_PASSWORD = "SELECT phone, password FROM mem_user WHERE phone = ANY(%s)"
+
+# 批量更新用户密码, 参数: [(phone, password_md5)]
+BATCH_UPDATE_PASSWORD = """
+UPDATE mem_user u
+SET password = v.password
+FROM (VALUES %s) AS v(phone, password)
+WHERE u.phone = v.phone
+RETURNING u.phone
+"""
+
+# 从库复制延迟(秒): 主库返回0; WAL接收进程正在流复制且已回放完收到的WAL时为0(主库空闲时回放时间戳不会更新);
+# 与主库断开时按最后回放事务的时间计算; 从未回放过事务时为NULL.
+# pg_stat_wal_receiver.status 需要 pg_read_all_stats(或 pg_monitor)权限才可见, 否则总是按回放时间计算
+REPLICATION_LAG = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn()
+        AND EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') THEN 0
+    ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+END
+"""
+
+# 主库当前WAL位置, 写入提交后读取, 作为读己之写的位置标记
+CURRENT_WAL_LSN = "SELECT pg_current_wal_lsn()::text"
+
+# 从库是否已回放到指定WAL位置(主库总是为真), 参数: (lsn,)
+REPLAYED_LSN = "SELECT NOT pg_is_in_recovery() OR pg_last_wal_replay_lsn() >= %s::pg_lsn"
+
+# 限制当前事务内SQL的执行时间(毫秒), 事务结束后恢复, 参数: (milliseconds,)
+SET_STATEMENT_TIMEOUT = "SET LOCAL statement_timeout = %s"
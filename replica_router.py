@@ -0,0 +1,151 @@
+"""从库读路由
+
+- 按环境轮询从库, 没有可用从库时读主库
+- 从库复制延迟每 lag_check_interval 秒在借出的连接上检查一次, 超过 max_lag 的从库到下次检查前不参与轮询
+- 连接失败的从库 retry_after 秒内不参与轮询
+- 手机号写入后 pin_seconds 秒内的读请求固定走主库, 保证读己之写; 该记录只在处理写入的进程内有效,
+  因此写入响应同时通过cookie带回主库当时的WAL位置, 其它worker收到携带该cookie的读请求时只使用已回放到该位置的从库
+只维护路由状态, 不持有连接, 同步(Flask)和异步(ASGI)模式共用
+"""
+import hashlib
+import itertools
+import math
+import re
+import threading
+import time
+
+from ttl_cache import TTLCache
+
+_LSN_PATTERN = re.compile(r'^[0-9A-F]{1,8}/[0-9A-F]{1,8}$')
+
+
+class ReplicaRouter:
+    def __init__(self, **settings):
+        self.configure(**settings)
+        self.reset()
+
+    def configure(self, enabled=True, max_lag=5, lag_check_interval=10, retry_after=30,
+                  pin_seconds=10, pin_max_entries=10000):
+        self.enabled = bool(enabled)
+        self.max_lag = float(max_lag)
+        self.lag_check_interval = float(lag_check_interval)
+        self.retry_after = float(retry_after)
+        self.pin_seconds = float(pin_seconds)
+        self.pin_max_entries = int(pin_max_entries)
+
+    def reset(self):
+        """清空路由状态(fork后的worker中调用)"""
+        self._lock = threading.Lock()
+        # client_key: 轮询计数器
+        self._counters = {}
+        # 从库连接池key: {'lag', 'checked_at', 'down_until', 'error'}
+        self._states = {}
+        # client_key: 最近写入过的手机号
+        self._pins = {}
+
+    def _state(self, replica_key):
+        return self._states.setdefault(
+            replica_key, {'lag': None, 'checked_at': None, 'down_until': 0.0, 'error': None})
+
+    def _available(self, state, now):
+        if state['down_until'] > now:
+            return False
+        if state['lag'] is None or state['lag'] <= self.max_lag:
+            return True
+        # 延迟过大的从库在检查过期后重新参与轮询, 由下一次检查决定
+        return now - state['checked_at'] >= self.lag_check_interval
+
+    def choose(self, client_key, replica_keys, phone=None, phones=()):
+        """选择本次读请求使用的从库, 返回 (replica_key, None) 或 (None, 读主库的原因)
+
+        批量读取通过 phones 传入全部手机号, 其中任一刚写入过时读主库
+        """
+        if not self.enabled:
+            return None, 'disabled'
+        if not replica_keys:
+            return None, 'no_replica'
+        if phone is not None and self.is_pinned(client_key, phone):
+            return None, 'pinned'
+        if phones and self.any_pinned(client_key, phones):
+            return None, 'pinned'
+        now = time.monotonic()
+        with self._lock:
+            counter = self._counters.setdefault(client_key, itertools.count())
+            start = next(counter)
+            for i in range(len(replica_keys)):
+                key = replica_keys[(start + i) % len(replica_keys)]
+                if self._available(self._state(key), now):
+                    return key, None
+        return None, 'unavailable'
+
+    def needs_lag_check(self, replica_key):
+        with self._lock:
+            checked_at = self._state(replica_key)['checked_at']
+        return checked_at is None or time.monotonic() - checked_at >= self.lag_check_interval
+
+    def record_lag(self, replica_key, lag):
+        """记录复制延迟(秒, None表示从库尚未回放任何事务), 返回该从库是否可以使用"""
+        lag = float('inf') if lag is None else float(lag)
+        with self._lock:
+            state = self._state(replica_key)
+            state.update(lag=lag, checked_at=time.monotonic(), down_until=0.0, error=None)
+        return lag <= self.max_lag
+
+    def mark_failed(self, replica_key, error):
+        with self._lock:
+            self._state(replica_key).update(down_until=time.monotonic() + self.retry_after, error=str(error))
+
+    def pin(self, client_key, phone):
+        """手机号刚写入主库, pin_seconds 秒内读主库"""
+        if self.pin_seconds <= 0:
+            return
+        pins = self._pins.get(client_key)
+        if pins is None:
+            pins = self._pins.setdefault(client_key, TTLCache(max_entries=self.pin_max_entries, ttl=self.pin_seconds))
+        pins.set(phone, True)
+
+    def is_pinned(self, client_key, phone):
+        pins = self._pins.get(client_key)
+        return pins is not None and pins.get(phone, False)
+
+    def any_pinned(self, client_key, phones):
+        pins = self._pins.get(client_key)
+        return pins is not None and len(pins) > 0 and bool(pins.get_many(phones))
+
+    def written_lsn_cookie(self, client_key):
+        """记录环境最近写入位置的cookie名, 每个环境一个"""
+        return 'bm_lsn_' + hashlib.md5(client_key.encode()).hexdigest()[:12]
+
+    def written_lsn(self, client_key, cookies):
+        """请求携带的本环境最近写入位置(如 '0/3000148'), 没有或格式不对时返回None"""
+        if not self.enabled:
+            return None
+        value = cookies.get(self.written_lsn_cookie(client_key))
+        return value if value and _LSN_PATTERN.match(value) else None
+
+    def written_lsn_cookie_args(self, client_key, lsn):
+        """写入响应上设置cookie的参数, Flask 和 Starlette 的 set_cookie 通用; 不需要时返回None"""
+        if not self.enabled or self.pin_seconds <= 0 or not lsn:
+            return None
+        return {
+            'key': self.written_lsn_cookie(client_key),
+            'value': lsn,
+            'max_age': math.ceil(self.pin_seconds),
+            'httponly': True,
+            'samesite': 'lax',
+        }
+
+    def snapshot(self, replica_keys):
+        """指定从库的状态, 用于健康检查"""
+        now = time.monotonic()
+        with self._lock:
+            result = {}
+            for key in replica_keys:
+                state = self._state(key)
+                result[key] = {
+                    'available': self._available(state, now),
+                    'lag': None if state['lag'] in (None, float('inf')) else round(state['lag'], 3),
+                    'checked_seconds_ago': None if state['checked_at'] is None else round(now - state['checked_at'], 1),
+                    'error': state['error'],
+                }
+        return result
@@ -684,18 +684,15 @@ async function updateGatewayUrl(configData = null) {
             return;
         }
         
-        // 构建带参数的请求URL
-        const url = `/get_gateway_url?server_address=${encodeURIComponent(serverAddress)}&namespace=${encodeURIComponent(namespace)}`;
-        
-        const response = await fetch(url);
-        const data = await response.json();
+        // 已保存环境的网关地址批量获取并由浏览器按ETag缓存
+        const gatewayUrl = await GatewayManager.resolve(serverAddress, namespace);
         const domainElement = document.getElementById('currentDomain');
         
-        if (data.success && data.gateway_url) {
+        if (gatewayUrl) {
             // 显示域名和IP地址
-            domainElement.textContent = data.gateway_url;
+            domainElement.textContent = gatewayUrl;
             // 添加Tooltip显示完整信息
-            domainElement.title = `IP地址: ${serverAddress}\n域名: ${data.gateway_url}`;
+            domainElement.title = `IP地址: ${serverAddress}\n域名: ${gatewayUrl}`;
         } else {
             domainElement.textContent = '未获取到网关配置';
             domainElement.title = `IP地址: ${serverAddress}\n未获取到网关配置`;
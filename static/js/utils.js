@@ -157,6 +157,49 @@ const DomainManager = {
     }
 };
 
+// 网关地址管理器: 一次获取所有已保存环境的网关地址
+// 响应带 Cache-Control/ETag, max-age 内由浏览器缓存直接返回, 之后重新验证, 未变化时服务端返回304
+const GatewayManager = {
+    pending: null,
+    // `${server_addresses}|${namespace}` -> 网关地址, 最近一次批量结果
+    gateways: new Map(),
+    load: function() {
+        if (this.pending) return this.pending;
+        this.pending = fetch('/get_gateway_urls', { credentials: 'same-origin' })
+            .then(response => response.json())
+            .then(data => {
+                if (data.success && Array.isArray(data.data)) {
+                    data.data.forEach(item => {
+                        if (item.status === 'ok') this.gateways.set(`${item.server_addresses}|${item.namespace}`, item.gateway_url);
+                    });
+                }
+                return this.gateways;
+            })
+            .finally(() => { this.pending = null; });
+        return this.pending;
+    },
+    fetchOne: function(serverAddress, namespace) {
+        const url = `/get_gateway_url?server_address=${encodeURIComponent(serverAddress)}&namespace=${encodeURIComponent(namespace)}`;
+        return fetch(url)
+            .then(response => response.json())
+            .then(data => data.success && data.gateway_url ? data.gateway_url : null);
+    },
+    // 已有批量结果时直接返回并在后台刷新; 否则批量请求与单个 /get_gateway_url 并行, 取先拿到地址的一个,
+    // 避免某个已保存环境响应慢时拖慢当前环境
+    resolve: function(serverAddress, namespace) {
+        const key = `${serverAddress}|${namespace}`;
+        const batch = this.load();
+        batch.catch(e => console.error('批量获取网关地址失败:', e));
+        const known = this.gateways.get(key);
+        if (known) return Promise.resolve(known);
+
+        const fromBatch = batch.then(gateways => gateways.get(key) || Promise.reject(new Error('批量结果中没有该环境')));
+        const single = this.fetchOne(serverAddress, namespace)
+            .then(gatewayUrl => gatewayUrl || Promise.reject(new Error('未获取到网关地址')));
+        return Promise.any([single, fromBatch]).catch(() => null);
+    }
+};
+
 // Bootstrap组件生命周期管理器
 const BootstrapComponentManager = {
     instances: new Map(),
@@ -255,15 +298,11 @@ function updateGatewayUrl() {
             return;
         }
         
-        // 构建带参数的请求URL
-        const url = `/get_gateway_url?server_address=${encodeURIComponent(serverAddress)}&namespace=${encodeURIComponent(namespace)}`;
-        
-        fetch(url)
-            .then(response => response.json())
-            .then(data => {
-                if (data.success && data.gateway_url) {
-                    DomainManager.updateDomainDisplay(data.gateway_url);
-                    DomainManager.saveToCache(data.gateway_url);
+        GatewayManager.resolve(serverAddress, namespace)
+            .then(gatewayUrl => {
+                if (gatewayUrl) {
+                    DomainManager.updateDomainDisplay(gatewayUrl);
+                    DomainManager.saveToCache(gatewayUrl);
                 } else {
                     const fallback = DomainManager.getFromCache();
                     DomainManager.updateDomainDisplay(fallback || null);
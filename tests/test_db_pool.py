@@ -0,0 +1,44 @@
+import time
+
+from db_pool import DBPool
+
+
+class FakeConnection:
+    closed = 0
+
+    def close(self):
+        self.closed = 1
+
+    def get_transaction_status(self):
+        return 0
+
+
+def test_reap_closes_idle_connections_without_traffic():
+    pool = DBPool('test', FakeConnection, min_size=1, max_size=5, idle_timeout=0.2, health_check=False)
+    try:
+        conns = [pool.getconn() for _ in range(4)]
+        for conn in conns:
+            pool.putconn(conn)
+        assert pool.stats()['idle'] == 4
+
+        time.sleep(0.3)
+        pool.reap()
+
+        stats = pool.stats()
+        assert stats['idle'] == 1
+        assert stats['evicted_idle'] == 3
+        assert sum(conn.closed for conn in conns) == 3
+    finally:
+        pool.close()
+
+
+def test_background_reaper_runs_periodically():
+    pool = DBPool('test', FakeConnection, min_size=0, max_size=2, idle_timeout=1)
+    try:
+        pool.putconn(pool.getconn())
+        deadline = time.monotonic() + 5
+        while pool.stats()['idle'] and time.monotonic() < deadline:
+            time.sleep(0.1)
+        assert pool.stats()['idle'] == 0
+    finally:
+        pool.close()
@@ -0,0 +1,70 @@
+"""Nacos不可达或配置为空时熔断器应记为失败并最终打开"""
+from urllib.error import URLError
+
+import pytest
+
+import app
+from circuit_breaker import BreakerRegistry, CircuitBreaker
+from nacos_cache import NacosConfigCache
+
+
+class UnreachableClient:
+    def __init__(self):
+        self.calls = []
+
+    def get_config(self, data_id, group, timeout=None, no_snapshot=None):
+        self.calls.append(no_snapshot)
+        raise URLError('Connection refused')
+
+
+class EmptyClient(UnreachableClient):
+    def get_config(self, data_id, group, timeout=None, no_snapshot=None):
+        self.calls.append(no_snapshot)
+        return None
+
+
+@pytest.fixture
+def env(monkeypatch):
+    server_address, namespace = '127.0.0.1:1', 'ns'
+    client_key = f'{server_address}_{namespace}'
+    # 失败缓存设为0, 每次调用都会真正访问Nacos, 只验证熔断器计数
+    monkeypatch.setattr(app, 'circuit_breakers',
+                        BreakerRegistry(failure_threshold=3, reset_timeout=60, failure_cache_ttl=0))
+    monkeypatch.setattr(app, 'nacos_config_cache', NacosConfigCache())
+    monkeypatch.setattr(app, 'active_nacos_clients', {})
+    monkeypatch.setattr(app, 'env_contexts', {})
+    return server_address, namespace, client_key
+
+
+@pytest.mark.parametrize('client_class, failure_status', [(UnreachableClient, 503), (EmptyClient, 404)])
+def test_breaker_opens_when_nacos_fails(env, client_class, failure_status):
+    server_address, namespace, client_key = env
+    client = client_class()
+    app.active_nacos_clients[client_key] = client
+
+    statuses = []
+    for _ in range(5):
+        with pytest.raises(app.EnvResolveError) as e:
+            app.resolve_env(server_address, namespace)
+        statuses.append(e.value.status)
+    # 熔断打开后报告环境不可用, 而不是配置不存在
+    assert statuses == [failure_status] * 3 + [503, 503]
+
+    snapshot = app.circuit_breakers.snapshot()[f'nacos:{client_key}']
+    assert snapshot['state'] == CircuitBreaker.OPEN
+    assert snapshot['failures'] == 3
+    assert snapshot['rejected'] == 2
+    # 打开后不再访问Nacos, 且不使用SDK的本地快照
+    assert client.calls == [True, True, True]
+
+
+def test_health_reports_open_nacos_breaker_as_unavailable(env):
+    server_address, namespace, client_key = env
+    app.active_nacos_clients[client_key] = UnreachableClient()
+    client = app.app.test_client()
+    # 前3次失败打开熔断器, 第4次快速失败
+    for _ in range(4):
+        response = client.get(f'/health?server_address={server_address}&namespace={namespace}')
+    assert response.status_code == 503
+    assert response.json['status'] == 'error'
+    assert 'Nacos环境不可用' in response.json['message']
@@ -0,0 +1,23 @@
+"""写入位置cookie: 每个环境独立, 只接受合法的WAL位置"""
+from replica_router import ReplicaRouter
+
+
+def test_written_lsn_round_trip():
+    router = ReplicaRouter(pin_seconds=7.5)
+    cookie = router.written_lsn_cookie_args('a:8848_ns', '0/3000148')
+    assert cookie['max_age'] == 8
+    assert router.written_lsn('a:8848_ns', {cookie['key']: cookie['value']}) == '0/3000148'
+    # 其它环境的WAL位置不可比较
+    assert router.written_lsn('b:8848_ns', {cookie['key']: cookie['value']}) is None
+
+
+def test_written_lsn_rejects_invalid_values():
+    router = ReplicaRouter()
+    name = router.written_lsn_cookie('a:8848_ns')
+    for value in ('', '0/xyz', "0/1'; DROP TABLE mem_user; --", '123'):
+        assert router.written_lsn('a:8848_ns', {name: value}) is None
+
+
+def test_no_cookie_when_disabled():
+    assert ReplicaRouter(enabled=False).written_lsn_cookie_args('k', '0/1') is None
+    assert ReplicaRouter(pin_seconds=0).written_lsn_cookie_args('k', '0/1') is None
@@ -0,0 +1,39 @@
+"""批量接口请求体解析: JSON和CSV共用 read_request_rows"""
+import pytest
+
+import app
+
+
+def parse(reader, **kwargs):
+    with app.app.test_request_context('/', method='POST', **kwargs):
+        return reader()
+
+
+def test_balance_rows_from_json_and_csv():
+    rows = [{'phone': '1', 'balance': '1.5'}, {'phone': '', 'balance': 1}, {'phone': '2', 'balance': 'x'}, 'bad']
+    assert parse(app.read_balance_rows, json={'rows': rows}) == (
+        {'1': 1.5},
+        [
+            {'row': 2, 'message': '手机号不能为空'},
+            {'row': 3, 'phone': '2', 'message': '余额不是有效数字'},
+            {'row': 4, 'message': '格式错误'},
+        ],
+    )
+    csv_body = 'phone,balance\n1,2\n1,3\n\n2,4\n'
+    assert parse(app.read_balance_rows, data=csv_body, content_type='text/csv') == ({'1': 3.0, '2': 4.0}, [])
+
+
+def test_password_rows():
+    read = lambda: app.read_password_rows('password')
+    assert parse(read, json={'phones': ['1', ' 2 '], 'password': 'p'}) == ({'1': 'p', '2': 'p'}, [])
+    assert parse(read, json=[['1', 'p'], ['2', '']]) == (
+        {'1': 'p'}, [{'row': 2, 'phone': '2', 'message': '密码不能为空'}])
+
+
+@pytest.mark.parametrize('reader, message', [
+    (app.read_balance_rows, 'JSON请求体缺少rows字段'),
+    (lambda: app.read_password_rows('password'), 'JSON请求体缺少phones或rows字段'),
+])
+def test_json_object_without_rows_is_rejected(reader, message):
+    with pytest.raises(ValueError, match=message):
+        parse(reader, json={'data': []})
@@ -0,0 +1,40 @@
+"""run_in_parallel 的超时按任务开始执行时计算, 排队的环境不会因前面的慢环境被记为超时"""
+import threading
+import time
+
+import app
+
+
+def test_queued_items_get_their_own_timeout():
+    release = threading.Event()
+
+    def lookup(item):
+        if item == 'slow':
+            release.wait(5)
+        return item
+
+    items = ['slow'] * 8 + ['fast'] * 2
+    started = time.monotonic()
+    try:
+        results, timed_out = app.run_in_parallel(lookup, items, 8, 0.3, 'test')
+    finally:
+        release.set()
+    assert timed_out
+    assert results == {8: 'fast', 9: 'fast'}
+    assert time.monotonic() - started < 2
+
+
+def test_total_timeout_stops_waiting_for_queued_items():
+    release = threading.Event()
+    try:
+        results, timed_out = app.run_in_parallel(lambda item: release.wait(5), range(4), 1, 0.3, 'test',
+                                                 total_timeout=0.2)
+    finally:
+        release.set()
+    assert timed_out
+    assert results == {}
+
+
+def test_all_items_finish():
+    results, timed_out = app.run_in_parallel(lambda item: item * 2, [1, 2, 3], 2, 1, 'test')
+    assert (results, timed_out) == ({0: 2, 1: 4, 2: 6}, False)
@@ -0,0 +1,84 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """线程安全的LRU缓存, 条目在 ttl 秒后过期(ttl<=0 表示不过期)"""
+
+    def __init__(self, max_entries=10000, ttl=5):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = float(ttl)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                value, expires_at = item
+                if expires_at is None or expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def get_many(self, keys):
+        """批量读取, 返回命中的 {key: value}"""
+        found = {}
+        with self._lock:
+            now = time.monotonic()
+            for key in keys:
+                item = self._data.get(key)
+                if item is not None and (item[1] is None or item[1] > now):
+                    self._data.move_to_end(key)
+                    found[key] = item[0]
+                    self.hits += 1
+                else:
+                    if item is not None:
+                        del self._data[key]
+                    self.misses += 1
+        return found
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl > 0 else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def set_many(self, items):
+        for key, value in items:
+            self.set(key, value)
+
+    def pop(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+        return item[0] if item is not None else None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            }